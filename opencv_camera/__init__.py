@@ -5,16 +5,21 @@
 ##############################################
 # -*- coding: utf-8 -*
 from .targets.chessboard import ChessboardFinder
+from .targets.tracker import TargetTracker
 # from .targets.apriltags import ApriltagTargetFinder
 
 from .mono.camera import Camera
 from .mono.calibrate import CameraCalibration
+from .mono.detection_cache import DetectionCache
+from .mono.select_views import selectViews
 
 from .stereo.camera import StereoCamera, UndistortStereo
 from .stereo.calibrate import StereoCalibration
+from .stereo.matcher import StereoMatcher
 from .stereo.fundamental_matrix import findFundamentalMat
 
 from .undistort import UnDistort
+from .map_cache import MapCache
 from .distortion import visualizeDistortion
 
 # from .apriltag.apriltag_detections import visualizeTargetDetections
@@ -30,6 +35,10 @@ from .display.stereo import coverage
 from .display.stereo import stereoOverlay
 
 from .threaded_camera import ThreadedCamera
+from .threaded_camera import Frame, FrameRing
+from .camera_group import CameraGroup, FrameSet
+from .async_camera import AsyncCamera
+from .shared_frames import FramePublisher, FrameSubscriber
 
 from .save.video import SaveVideo
 
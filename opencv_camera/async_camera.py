@@ -0,0 +1,133 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2014 Kevin Walchko
+# see LICENSE for full details
+##############################################
+# -*- coding: utf-8 -*
+import asyncio
+from collections import deque
+from .color_space import ColorSpace
+from .threaded_camera import ThreadedCamera
+
+
+class AsyncCamera:
+    """
+    asyncio interface to a ThreadedCamera. The capture thread tells the event
+    loop about every new frame with loop.call_soon_threadsafe(), so a
+    coroutine awaiting a frame wakes up as soon as it is captured, without
+    polling.
+
+    Only the sequence numbers of the newest maxsize frames are queued. If the
+    consumer falls behind, the oldest are thrown away (counted in dropped),
+    and a frame is only copied out of the camera's ring when it is consumed.
+    Several coroutines can wait at once, each frame goes to one of them.
+
+    async def main():
+        cam = AsyncCamera(ThreadedCamera(thread_hz=None))
+        cam.open(0, (480,640))
+        async for frame in cam:      # Frame(seq, timestamp, image)
+            ...
+        frame = await cam.next_frame()
+        await cam.aclose()
+    """
+    def __init__(self, camera=None, maxsize=1):
+        """
+        camera: ThreadedCamera to wrap, default is an event driven one
+        maxsize: frames queued for a slow consumer before old ones are dropped
+        """
+        if camera is None:
+            camera = ThreadedCamera(thread_hz=None)
+        self.camera = camera
+        self.queue = deque()
+        self.maxsize = maxsize
+        self.dropped = 0   # frames the consumer never saw
+        self.waiters = []  # futures of the coroutines waiting for a frame
+        self.loop = None
+        self.closed = False
+
+    def open(self, path=0, resolution=None, fmt=ColorSpace.bgr):
+        """
+        Opens the camera, see ThreadedCamera.open(). Call from the event loop
+        thread, frames are delivered to the running loop.
+        """
+        self.attach()
+        self.camera.open(path, resolution, fmt)
+        return self
+
+    def attach(self, loop=None):
+        """
+        Starts delivering frames of an already open camera to loop, default
+        is the running loop
+        """
+        self.loop = asyncio.get_running_loop() if loop is None else loop
+        self.closed = False
+        self.camera.add_callback(self._captured)
+
+    def close(self):
+        """
+        Stops the camera and ends any async for loops. This joins the capture
+        thread, which can block the event loop for up to a second, use
+        aclose() from a coroutine.
+        """
+        self.closed = True
+        self.camera.remove_callback(self._captured)
+        self._wake()
+        self.camera.close()
+
+    async def aclose(self):
+        """close() without blocking the event loop"""
+        self.closed = True
+        self.camera.remove_callback(self._captured)
+        self._wake()
+        await asyncio.get_running_loop().run_in_executor(None, self.camera.close)
+
+    def _captured(self, seq, timestamp, image):
+        """Capture thread, hands the sequence number to the event loop"""
+        try:
+            self.loop.call_soon_threadsafe(self._push, seq)
+        except RuntimeError:
+            pass # loop is closed
+
+    def _push(self, seq):
+        """Event loop, queues a new frame and wakes the consumer"""
+        self.queue.append(seq)
+        while len(self.queue) > self.maxsize:
+            self.queue.popleft()
+            self.dropped += 1
+        self._wake()
+
+    def _wake(self):
+        waiters, self.waiters = self.waiters, []
+        for w in waiters:
+            if not w.done():
+                w.set_result(None)
+
+    async def next_frame(self):
+        """Returns the next Frame, or None if the camera is closed"""
+        while True:
+            while self.queue:
+                seq = self.queue.popleft()
+                frame = self.camera.ring.get(seq)
+                if frame is not None:
+                    return frame
+                self.dropped += 1 # overwritten in the ring before we got to it
+
+            if self.closed:
+                return None
+
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter) # cancelled
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        frame = await self.next_frame()
+        if frame is None:
+            raise StopAsyncIteration
+        return frame
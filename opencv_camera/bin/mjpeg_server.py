@@ -6,12 +6,12 @@
 # see LICENSE for full details
 ##############################################
 import cv2
-from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
-import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+import queue
 import argparse
-# from opencv_camera import CameraCV
+import sys
 from opencv_camera import ThreadedCamera
-import socket as Socket
 from opencv_camera import __version__ as VERSION
 import os
 import re
@@ -22,85 +22,130 @@ import platform
 # slow. feeding it the correct ip address seems to greatly speed things up.
 
 os_name = platform.system()
-camera = None
 
 
 def getIP(iface):
-    if os_name == 'Darwin':
-        ipv4 = socket.gethostbyname(socket.gethostname())
-        ipv6 = None
-    elif os_name == 'Linux':
-        search_str = 'ip addr show wlan0'.format(iface)
-        ipv4 = re.search(re.compile(r'(?<=inet )(.*)(?=\/)', re.M), os.popen(search_str).read()).groups()[0]
-        ipv6 = re.search(re.compile(r'(?<=inet6 )(.*)(?=\/)', re.M), os.popen(search_str).read()).groups()[0]
-    else:
-        ipv4 = socket.gethostbyname(socket.gethostname())
-        ipv6 = None
+    if os_name == 'Linux':
+        out = os.popen(f'ip addr show {iface} 2>/dev/null').read()
+        ipv4 = re.search(r'(?<=inet )(.*)(?=\/)', out, re.M)
+        ipv6 = re.search(r'(?<=inet6 )(.*)(?=\/)', out, re.M)
+        if ipv4 is not None:
+            return (ipv4.group(0), ipv6.group(0) if ipv6 else None)
 
-    return (ipv4, ipv6)
-
-
-def setUpCameraPi(win=(320, 240)):
-    global camera
-    camera = Camera('pi')
-    camera.init(win=win)
-
-
-def setUpCameraCV(win=(320, 240), cv=0):
-    global camera
-    camera = Camera('cv')
-    camera.init(cameraNumber=cv, win=win)
+    # Darwin, Windows or no such interface
+    ipv4 = socket.gethostbyname(socket.gethostname())
+    return (ipv4, None)
 
 
 def compress(orig, comp):
     return float(orig) / float(comp)
 
 
+class JpegBroadcaster(Thread):
+    """
+    Encodes every new camera frame to a jpeg once and hands it to every
+    client. Each client has a small queue, if a client is too slow to keep up
+    its oldest jpeg is thrown away, so it always gets the newest frames and
+    never slows down the camera or the other clients. Nothing is encoded when
+    no one is watching.
+    """
+    def __init__(self, camera, quality=80, queue_size=2):
+        Thread.__init__(self)
+        self.daemon = True
+        self.camera = camera
+        self.encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+        self.queue_size = queue_size
+        self.clients = []
+        self.lock = Lock()
+        self.running = True
+        self.encoded = 0 # frames encoded
+
+    def subscribe(self):
+        q = queue.Queue(self.queue_size)
+        with self.lock:
+            self.clients.append(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.clients.remove(q)
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        seq = None
+        while self.running:
+            frame = self.camera.wait_for_frame(1.0, seq)
+            if frame is None:
+                continue
+            seq = frame.seq
+
+            with self.lock:
+                clients = list(self.clients)
+            if not clients:
+                continue
+
+            ok, jpg = cv2.imencode('.jpg', frame.image, self.encode_param)
+            if not ok:
+                continue
+            self.encoded += 1
+            jpg = jpg.tobytes()
+
+            for q in clients:
+                try:
+                    q.put_nowait(jpg)
+                except queue.Full:
+                    # slow client, drop its stale frame for this one
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+                    try:
+                        q.put_nowait(jpg)
+                    except queue.Full:
+                        pass
+
+
 class mjpgServer(BaseHTTPRequestHandler):
     """
-    A simple mjpeg server that either publishes images directly from a camera
-    or republishes images from another pygecko process.
+    A simple mjpeg server that publishes images directly from a camera. Each
+    connection runs in its own thread and gets its jpegs from the
+    JpegBroadcaster, so more viewers don't mean more encoding.
     """
 
     ip = None
     hostname = None
+    broadcaster = None
 
     def do_GET(self):
-        global camera
         print('connection from:', self.address_string())
 
-        if self.ip is None or self.hostname is None:
-            self.ip, _ = getIP('wlan0')
-            self.hostname = Socket.gethostname()
-
         if self.path == '/mjpg':
             self.send_response(200)
             self.send_header(
                 'Content-type',
-                'multipart/x-mixed-replace; boundary=--jpgboundary'
+                'multipart/x-mixed-replace; boundary=jpgboundary'
             )
             self.end_headers()
 
-            while True:
-                if camera:
-                    ret, img = camera.read()
-
-                else:
-                    raise Exception('Error, camera not setup')
-
-                if not ret:
-                    print('no image from camera')
-                    time.sleep(1)
-                    continue
-
-                ret, jpg = cv2.imencode('.jpg', img)
-                # print 'Compression ratio: %d4.0:1'%(compress(img.size,jpg.size))
-                self.wfile.write("--jpgboundary")
-                self.send_header('Content-type', 'image/jpeg')
-                # self.send_header('Content-length',str(tmpFile.len))
-                self.send_header('Content-length', str(jpg.size))
-                self.end_headers()
-                self.wfile.write(jpg.tostring())
+            q = self.broadcaster.subscribe()
+            try:
+                while self.broadcaster.running:
+                    try:
+                        jpg = q.get(timeout=1.0)
+                    except queue.Empty:
+                        continue
+
+                    self.wfile.write(b"--jpgboundary\r\n")
+                    self.wfile.write(b"Content-type: image/jpeg\r\n")
+                    self.wfile.write(f"Content-length: {len(jpg)}\r\n\r\n".encode())
+                    self.wfile.write(jpg)
+                    self.wfile.write(b"\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                print('disconnected:', self.address_string())
+            finally:
+                self.broadcaster.unsubscribe(q)
 
         elif self.path == '/':
             # hn = self.server.server_address[0]
@@ -108,32 +153,43 @@ class mjpgServer(BaseHTTPRequestHandler):
             ip = self.ip
             hostname = self.hostname
 
+            html = (
+                '<html><head></head><body>'
+                f'<h1>{hostname}[{ip}]:{port}</h1>'
+                f'<img src="http://{ip}:{port}/mjpg"/>'
+                f'<p>{self.version_string()}</p>'
+                '</body></html>'
+            ).encode()
+
             self.send_response(200)
             self.send_header('Content-type', 'text/html')
+            self.send_header('Content-length', str(len(html)))
             self.end_headers()
-            self.wfile.write('<html><head></head><body>')
-            self.wfile.write('<h1>{0!s}[{1!s}]:{2!s}</h1>'.format(hostname, ip, port))
-            self.wfile.write('<img src="http://{}:{}/mjpg"/>'.format(ip, port))
-            self.wfile.write('<p>{0!s}</p>'.format((self.version_string())))
-            self.wfile.write('<p>This only handles one connection at a time</p>')
-            self.wfile.write('</body></html>')
+            self.wfile.write(html)
 
         else:
             print('error', self.path)
+            html = (
+                '<html><head></head><body>'
+                f'<h1>{self.path} not found</h1>'
+                '</body></html>'
+            ).encode()
+
             self.send_response(404)
             self.send_header('Content-type', 'text/html')
+            self.send_header('Content-length', str(len(html)))
             self.end_headers()
-            self.wfile.write('<html><head></head><body>')
-            self.wfile.write('<h1>{0!s} not found</h1>'.format(self.path))
-            self.wfile.write('</body></html>')
+            self.wfile.write(html)
 
 
 def handleArgs():
-    parser = argparse.ArgumentParser(version=VERSION, description='A simple mjpeg server Example: mjpeg-server -p 8080 --camera 4')
+    parser = argparse.ArgumentParser(description='A simple mjpeg server, any number of browsers can watch at once. Example: mjpeg-server -p 8080 --camera 4')
     parser.add_argument('-p', '--port', help='mjpeg publisher port, default is 9000', type=int, default=9000)
     parser.add_argument('-c', '--camera', help='set opencv camera number, ex. -c 1', type=int, default=0)
-    parser.add_argument('-t', '--type', help='set camera type, either pi or cv, ex. -t pi', default='cv')
-    parser.add_argument('-s', '--size', help='set size', nargs=2, type=int, default=(320, 240))
+    parser.add_argument('-s', '--size', help='set size (width height), default is 320 240', nargs=2, type=int, default=(320, 240))
+    parser.add_argument('-q', '--quality', help='jpeg quality percentage, default is 80', type=int, default=80)
+    parser.add_argument('-i', '--iface', help='network interface to serve on (Linux), default is wlan0', default='wlan0')
+    parser.add_argument('-v', '--version', action='version', help='returns version number', version=f"{sys.argv[0]} version {VERSION}")
 
     args = vars(parser.parse_args())
     args['size'] = (args['size'][0], args['size'][1])
@@ -143,28 +199,31 @@ def handleArgs():
 def main():
     args = handleArgs()
 
-    try:
-        win = args['size']
-        if args['type'] == 'cv':
-            print('Setting up an OpenCV camera')
-            cv = args['camera']
-            setUpCameraCV(cv=cv, win=win)
-        else:
-            print('Setting up a Raspberry Pi camera')
-            setUpCameraPi(win=win)
+    w, h = args['size']
+    print('Setting up an OpenCV camera')
+    camera = ThreadedCamera(thread_hz=None)
+    camera.open(args['camera'], (h, w))
 
-        ipv4, ipv6 = getIP('wlan0')
+    broadcaster = JpegBroadcaster(camera, args['quality'])
+    broadcaster.start()
 
-        mjpgServer.ip = ipv4
-        mjpgServer.hostname = Socket.gethostname()
-        server = HTTPServer((ipv4, args['port']), mjpgServer)
-        print("server started on {}:{}".format(Socket.gethostname(), args['port']))
-        server.serve_forever()
+    ipv4, ipv6 = getIP(args['iface'])
+
+    mjpgServer.ip = ipv4
+    mjpgServer.hostname = socket.gethostname()
+    mjpgServer.broadcaster = broadcaster
+    server = ThreadingHTTPServer((ipv4, args['port']), mjpgServer)
+    server.daemon_threads = True
+    print("server started on {}[{}]:{}".format(socket.gethostname(), ipv4, args['port']))
 
+    try:
+        server.serve_forever()
     except KeyboardInterrupt:
         print('KeyboardInterrupt')
 
-    server.socket.close()
+    broadcaster.stop()
+    server.server_close()
+    camera.close()
 
 
 if __name__ == '__main__':
@@ -9,22 +9,38 @@
 import socket
 import cv2
 import numpy as np
-import struct
 from threading import Thread, Lock
 import argparse
+import time
+from opencv_camera.udp_transport import FrameAssembler, Subscribers, packControl
+from opencv_camera.udp_transport import STOP, REQUEST, SUBSCRIBE, UNSUBSCRIBE
 
 class ImageGrabber(Thread):
-    def __init__(self, host, port):
+    def __init__(self, host, port, push=True, rate=0):
+        """
+        host, port: udp_server address
+        push: subscribe and have the server send every image, otherwise
+            request one image at a time
+        rate: with push, max images per second (0 is as fast as the camera)
+        """
         Thread.__init__(self)
         self.lock = Lock()
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # room for a few large frames worth of chunks
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2**22)
         self.server_address = (host, port)
         self.sock.settimeout(0.05)
+        self.assembler = FrameAssembler(timeout=0.2)
         self.array = None
         self.running = True
+        self.push = push
+        self.rate = rate
 
     def stopServer(self):
-        self.sock.sendto(struct.pack('<L',0), self.server_address)
+        self.sock.sendto(packControl(STOP), self.server_address)
+
+    def unsubscribe(self):
+        self.sock.sendto(packControl(UNSUBSCRIBE), self.server_address)
 
     def imageGrabber(self):
         if self.array is not None:
@@ -34,34 +50,27 @@ class ImageGrabber(Thread):
             return array
 
     def run(self):
+        keepalive = 0
         while self.running:
             try:
-                self.sock.sendto(struct.pack('<L',1), self.server_address)
-                try:
-                    data_len_packed, server = self.sock.recvfrom(struct.calcsize('<L'))
-                except socket.timeout:
-                    continue
-                data_len = struct.unpack('<L',data_len_packed)[0]
-                # if data_len < 65507:
-                print(f"byte recv: {data_len}", end="\r")
-                try:
-                    data, server = self.sock.recvfrom(data_len)
-                except socket.timeout:
-                    continue
-                except Exception:
-                    continue
-                if not len(data) == data_len:
-                    print ("There was a image packet loss...")
-                    continue
-                if data == 404:
-                    continue
+                if not self.push:
+                    self.sock.sendto(packControl(REQUEST), self.server_address)
+                elif time.monotonic() - keepalive > Subscribers.KEEPALIVE:
+                    # subscribe, or tell the server we are still here
+                    self.sock.sendto(packControl(SUBSCRIBE, self.rate), self.server_address)
+                    keepalive = time.monotonic()
+
+                data = self.assembler.recv(self.sock, 0.2)
+                if data is None:
+                    continue # lost, incomplete frames are dropped
 
+                print(f"byte recv: {len(data)}", end="\r")
+
+                # the assembler reuses its buffers, keep a copy
                 self.lock.acquire()
-                self.array = np.frombuffer(data, dtype=np.dtype('uint8'))
+                self.array = data.copy()
                 self.lock.release()
 
-                # print(f"{self.array.shape}")
-
             except:
                 self.running = False
                 self.lock.acquire()
@@ -77,7 +86,10 @@ def handle_args():
     # parser.add_argument('-c', '--camera', help='which camera to use, default is 0', default=0)
     parser.add_argument('host', help='host ip address', default=None)
     # parser.add_argument('-q', '--quality', help='jpeg quality percentage, default is 80', default=80)
-    parser.add_argument('-p','--port', help='port, default is 9050', default=9050)
+    parser.add_argument('-p','--port', type=int, help='port, default is 9050', default=9050)
+    parser.add_argument('-r','--rate', type=float, help='max images per second, default is 0 (camera rate)', default=0)
+    parser.add_argument('--pull', action='store_true', help='request each image instead of having the server push them')
+    parser.add_argument('--stop', action='store_true', help='stop the server on exit')
     # parser.add_argument('-s', '--size', type=int, help='size of image capture (480=(640x480), 720=(1280x720)), default 240')
     # parser.add_argument('-v', '--version', action='store_true', help='returns version number')
 
@@ -88,7 +100,7 @@ def main():
     host = args["host"]
     port = args["port"]
 
-    image = ImageGrabber(host, port)
+    image = ImageGrabber(host, port, not args["pull"], args["rate"])
     image.daemon = True
     image.start()
 
@@ -109,7 +121,12 @@ def main():
     except:
         pass
     finally:
-        image.stopServer()
+        image.running = False
+        image.join(1.0)
+        if args["stop"]:
+            image.stopServer()
+        else:
+            image.unsubscribe()
         image.sock.close()
 
 
@@ -8,11 +8,14 @@
 
 import socket
 import cv2
-from threading import Thread, Lock
-import struct
+import itertools
+from threading import Thread, Lock, Condition
 import argparse
 from colorama import Fore
 from opencv_camera import __version__ as version
+from opencv_camera.udp_transport import sendFrame, CHUNK_SIZE
+from opencv_camera.udp_transport import Subscribers, unpackControl
+from opencv_camera.udp_transport import STOP, REQUEST, SUBSCRIBE, UNSUBSCRIBE
 
 debug = True
 host_name = socket.gethostname()
@@ -35,16 +38,23 @@ class VideoGrabber(Thread):
             elif size == 720:
                 self.cap.set(3, 1280)
                 self.cap.set(4, 720)
+            elif size == 1080:
+                self.cap.set(3, 1920)
+                self.cap.set(4, 1080)
             else:
                 print(f"{Fore.RED}*** Invalide image size: {size} ***{Fore.RESET}")
                 print("Using camera default")
 
             self.running = True
             self.buffer = None
+            self.count = 0 # frames encoded
             self.lock = Lock()
+            self.cond = Condition(self.lock)
 
         def stop(self):
             self.running = False
+            with self.cond:
+                self.cond.notify_all()
 
         def get_buffer(self):
 
@@ -54,6 +64,18 @@ class VideoGrabber(Thread):
                     self.lock.release()
                     return cpy
 
+        def wait_frame(self, count, timeout=1.0):
+            """
+            Waits for a frame newer than count and returns (count, jpeg), or
+            (count, None) on timeout. The jpeg is never changed after it is
+            encoded, so no copy is needed.
+            """
+            with self.cond:
+                self.cond.wait_for(lambda: self.count > count or not self.running, timeout)
+                if self.count > count and self.buffer is not None:
+                    return self.count, self.buffer
+                return count, None
+
         def run(self):
             while self.running:
                 ok, img = self.cap.read()
@@ -64,25 +86,57 @@ class VideoGrabber(Thread):
                     img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
                 # print(img.shape)
-                self.lock.acquire()
-                result, self.buffer = cv2.imencode('.jpg', img, self.encode_param)
-                self.lock.release()
+                result, buffer = cv2.imencode('.jpg', img, self.encode_param)
+                with self.cond:
+                    self.buffer = buffer
+                    self.count += 1
+                    self.cond.notify_all()
+
+
+def push(sock, grabber, subs, ids, chunk):
+    """Sends every new frame to the subscribed clients"""
+    count = 0
+    while grabber.running:
+        count, buffer = grabber.wait_frame(count)
+        if buffer is None:
+            continue
+        frame_id = next(ids)
+        for address in subs.due():
+            try:
+                sendFrame(sock, address, frame_id, buffer, chunk)
+            except OSError as e:
+                # unreachable client, it stops getting frames once it expires
+                print(f"{Fore.RED}*** {address}: {e} ***{Fore.RESET}")
+
+def reply(sock, address, grabber, ids, chunk):
+    """
+    Sends the newest frame to a client that asked for it. Every reply gets a
+    new frame id, even if the camera hasn't captured a new frame since the
+    last one, otherwise the client would throw it away as a late frame.
+    """
+    count, buffer = grabber.wait_frame(0, 0)
+    if buffer is None:
+        return
+    sendFrame(sock, address, next(ids), buffer, chunk)
 
 def handle_args():
     # parser = argparse.ArgumentParser(version=VERSION, description='A simple \
     parser = argparse.ArgumentParser(description=f'A simple \
     program to capture images from a camera and send them over the network \
-    as a UDP message. Unfortunately, you cannot send large images. The \
-    messages are limited to 65507 bytes. So the larger the image, the lower \
-    jpeg quality needs to be. You can easily do 240 @ 100% or 480 @ 95% \
-    or 720 @ 65%.')
+    as UDP messages. Each image is split into numbered chunks that the \
+    client puts back together, so any size and jpeg quality can be sent. \
+    A lost chunk loses the whole image, so large images need a good \
+    (wired) network. Clients either request one image at a time or \
+    subscribe once and get every image pushed to them.')
 
     parser.add_argument('-c', '--camera', help='which camera to use, default is 0', default=0)
     parser.add_argument('-g', '--grayscale', action='store_true', help='capture grayscale images, reduces data size')
     parser.add_argument('host', help='host ip address', default=None)
     parser.add_argument('-q', '--quality', type=int, help='jpeg quality percentage, default is 80', default=80)
-    parser.add_argument('-p','--port', help='port, default is 9050', default=9050)
-    parser.add_argument('-s', '--size', type=int, help='size of image capture (480=(640x480), 720=(1280x720)), default 240', default=240)
+    parser.add_argument('-p','--port', type=int, help='port, default is 9050', default=9050)
+    parser.add_argument('-s', '--size', type=int, help='size of image capture (480=(640x480), 720=(1280x720), 1080=(1920x1080)), default 240', default=240)
+    parser.add_argument('--chunk', type=int, help=f'bytes per UDP message, default is {CHUNK_SIZE}', default=CHUNK_SIZE)
+    parser.add_argument('--expire', type=float, help='seconds without a keepalive before a subscriber is dropped, default is 3', default=3.0)
     parser.add_argument('-v', '--version', action='store_true', help='returns version number')
 
     return vars(parser.parse_args())
@@ -100,6 +154,7 @@ def main():
     size = args["size"]
     camera = args["camera"]
     gray = args["grayscale"]
+    chunk = args["chunk"]
 
     grabber = VideoGrabber(jpeg_quality, size, camera, gray)
     grabber.daemon = True
@@ -115,23 +170,31 @@ def main():
     print(f'starting up on {host_name}[{host}] port {port}\n')
 
     sock.bind(server_address)
+
+    # ids of the frames sent, shared by push() and reply() so they always
+    # increase (next() of a count is atomic)
+    ids = itertools.count(1)
+
+    subs = Subscribers(args["expire"])
+    pusher = Thread(target=push, args=(sock, grabber, subs, ids, chunk))
+    pusher.daemon = True
+    pusher.start()
+
     try:
         while running:
-            data_packed, address = sock.recvfrom(struct.calcsize('<L'))
-            data = struct.unpack('<L',data_packed)[0]
+            data_packed, address = sock.recvfrom(64)
+            data, rate = unpackControl(data_packed)
             # print(data)
-            if data == 1:
-                buffer = grabber.get_buffer()
-                if buffer is None:
-                    continue
-                if len(buffer) > 65507:
-                    print (f"{Fore.RED}*** Image exceeds UDP message size (65507): {len(buffer)} ***{Fore.RESET}")
-                    sock.sendto(struct.pack('<L',struct.calcsize('<L')), address)
-                    sock.sendto(struct.pack('L',404), address) #capture error
-                    continue
-                sock.sendto(struct.pack('<L',len(buffer)), address)
-                sock.sendto(buffer.tobytes(), address)
-            elif data == 0:
+            if data == REQUEST:
+                reply(sock, address, grabber, ids, chunk)
+            elif data == SUBSCRIBE:
+                if address not in subs.clients:
+                    print(f">> subscribed: {address}")
+                subs.subscribe(address, rate)
+            elif data == UNSUBSCRIBE:
+                subs.unsubscribe(address)
+                print(f">> unsubscribed: {address}")
+            elif data == STOP:
                 grabber.stop()
                 running = False
     except KeyboardInterrupt:
@@ -143,6 +206,7 @@ def main():
     running = False
     print("Quitting..")
     grabber.join()
+    pusher.join(1.0)
     sock.close()
 
 
@@ -0,0 +1,215 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2014 Kevin Walchko
+# see LICENSE for full details
+##############################################
+# -*- coding: utf-8 -*
+from collections import deque
+from dataclasses import dataclass
+from threading import Thread, Condition
+import time
+from .color_space import ColorSpace
+from .threaded_camera import ThreadedCamera
+
+
+@dataclass
+class FrameSet:
+    """
+    Frames from every camera in a CameraGroup, captured together
+
+    seq: monotonic frameset sequence number
+    frames: list of Frame, one per camera in the order they were opened
+    """
+    seq: int
+    frames: list
+
+    @property
+    def skew(self):
+        """Spread in seconds between the first and last capture timestamp"""
+        stamps = [f.timestamp for f in self.frames]
+        return max(stamps) - min(stamps)
+
+    @property
+    def images(self):
+        return [f.image for f in self.frames]
+
+
+@dataclass
+class CameraGroup:
+    """
+    Captures from several cameras in one thread so their frames line up in
+    time. Every loop grab()s all of the cameras back to back, which is cheap
+    since nothing is decoded, and only then retrieve()s the images. Cameras
+    whose frame is more than skew seconds older than the newest one grab()
+    again (up to retries times), so a camera that is a frame behind catches
+    up instead of every set being thrown away. A set of frames is kept only
+    if all of the timestamps end up within skew seconds of each other,
+    otherwise it is thrown away and counted in drops.
+
+    Free running cameras are not in phase. If the phase offset between two
+    cameras is bigger than skew, no set can ever be made and every set is
+    dropped, use a bigger skew or hardware triggered cameras. Timestamps are
+    from ThreadedCamera.grab(), see it for how close they are to the real
+    capture time (driver_time uses the driver's timestamps).
+
+    Stereo depth is only correct if the left and right images were captured
+    at (nearly) the same time, so use this instead of two ThreadedCameras.
+
+    g = CameraGroup(skew=0.002)
+    g.open([0,1], (480,640))       # camera 0 and 1, (rows, cols)
+    fs = g.wait_for_frameset(1)    # FrameSet or None on timeout
+    left, right = fs.images
+    g.drops                        # [framesets lost to camera 0, camera 1]
+    g.close()
+    """
+
+    skew: float = 0.002   # max capture time spread in a frameset, seconds
+    buffer_size: int = 4  # framesets kept, also ring size of each camera
+    retries: int = 2      # extra grab()s to bring a camera that is behind into a set
+    driver_time: bool = False # time stamp frames with the driver's clock
+    run: bool = False     # thread loop run parameter
+    cameras = None        # ThreadedCamera per device
+    drops = None          # framesets lost because of each camera
+    sets = None           # recent (frameset seq, [camera seqs])
+    head = -1             # newest frameset sequence number
+    cond = None           # Condition notified on every new frameset
+    ps = None             # thread process
+
+    def __del__(self):
+        self.close()
+
+    def open(self, paths, resolution=None, fmt=ColorSpace.bgr):
+        """
+        Opens all of the cameras and starts the capture thread
+
+        paths: list of cameras to open, ex: [0,1]
+        resolution: what supported resolution from the cameras do you want (height,width)
+        fmt: image format, 1(BGR), 2(RGB), 4(HSV), 8(grayscale), default is BGR
+        """
+        self.cameras = []
+        for path in paths:
+            cam = ThreadedCamera(buffer_size=self.buffer_size, driver_time=self.driver_time)
+            cam.open(path, resolution, fmt, start=False)
+            self.cameras.append(cam)
+
+        self.drops = [0]*len(self.cameras)
+        self.sets = deque(maxlen=self.buffer_size)
+        self.head = -1
+        self.cond = Condition()
+        self.run = True
+
+        self.ps = Thread(target=self.thread_func)
+        self.ps.daemon = True
+        self.ps.start()
+        return self
+
+    def close(self):
+        self.run = False
+        if self.cond is not None:
+            with self.cond:
+                self.cond.notify_all()
+        if self.ps is not None:
+            self.ps.join(1.0)
+            self.ps = None
+        if self.cameras is not None:
+            for cam in self.cameras:
+                cam.close()
+            self.cameras = None
+
+    def read(self):
+        """Returns (True, [images]) or (False, None) if no frameset captured"""
+        fs = self.read_latest()
+        if fs is None:
+            return False, None
+        return True, fs.images
+
+    def read_latest(self):
+        """Returns the newest FrameSet or None"""
+        if self.sets is None:
+            return None
+
+        # newest first, an older set is still better than nothing if the
+        # newest was overwritten while we copied it
+        for seq, seqs in reversed(list(self.sets)):
+            fs = self._get(seq, seqs)
+            if fs is not None:
+                return fs
+        return None
+
+    def wait_for_frameset(self, timeout=None, seq=None):
+        """
+        Blocks until a frameset newer than seq is captured and returns the
+        newest FrameSet, or None on timeout or if the group is closed.
+
+        timeout: seconds to wait, None waits forever
+        seq: frameset sequence number already seen, default is the newest at
+            the time of the call, so this waits for the next one
+        """
+        if self.cond is None:
+            return None
+
+        with self.cond:
+            if seq is None:
+                seq = self.head
+            ok = self.cond.wait_for(lambda: self.head > seq or not self.run, timeout)
+
+        if not ok or not self.run:
+            return None
+        return self.read_latest()
+
+    def _get(self, seq, seqs):
+        frames = []
+        for cam, s in zip(self.cameras, seqs):
+            frame = cam.ring.get(s)
+            if frame is None:
+                return None
+            frames.append(frame)
+        return FrameSet(seq, frames)
+
+    def thread_func(self):
+        """Internal function, do not call"""
+        cameras = self.cameras
+
+        while self.run:
+            # grab everything first so the capture times are as close as
+            # possible, decoding takes much longer than grabbing
+            stamps = [cam.grab()[1] for cam in cameras]
+
+            # cameras holding an older frame grab again to catch up to the
+            # newest one
+            for _ in range(self.retries):
+                if None in stamps:
+                    break
+                newest = max(stamps)
+                early = [i for i, ts in enumerate(stamps) if newest - ts > self.skew]
+                if not early:
+                    break
+                for i in early:
+                    stamps[i] = cameras[i].grab()[1]
+
+            failed = [i for i, ts in enumerate(stamps) if ts is None]
+            if failed:
+                for i in failed:
+                    self.drops[i] += 1
+                time.sleep(0.001) # don't spin on a dead camera
+                continue
+
+            first = min(stamps)
+            late = [i for i, ts in enumerate(stamps) if ts - first > self.skew]
+            if late:
+                for i in late:
+                    self.drops[i] += 1
+                continue
+
+            seqs = []
+            for i, (cam, ts) in enumerate(zip(cameras, stamps)):
+                s = cam.retrieve(ts)
+                if s is None:
+                    self.drops[i] += 1
+                    break
+                seqs.append(s)
+            else:
+                with self.cond:
+                    self.sets.append((self.head + 1, seqs))
+                    self.head += 1
+                    self.cond.notify_all()
@@ -0,0 +1,107 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2014 Kevin Walchko
+# see LICENSE for full details
+##############################################
+# -*- coding: utf-8 -*
+import hashlib
+import os
+from pathlib import Path
+import numpy as np
+
+
+class MapCache:
+    """
+    On disk cache of undistortion maps. cv2.initUndistortRectifyMap() takes
+    seconds at high resolution on a Raspberry Pi, so build the maps once and
+    load them from here afterwards.
+
+    Maps are stored as .npy files keyed by a hash of K, d, R, image size,
+    alpha and map type, and loaded memory mapped. Every process using the same
+    calibration shares one physical copy through the OS page cache.
+
+    source: optional calibration yaml file the maps came from. If it changes
+        (modification time or size), all of the maps built from it are
+        deleted the next time the cache is used.
+
+    cache = MapCache(source="camera.yml")
+    cam = Camera.from_yaml("camera.yml")
+    un = cam.getUndistortion(cache=cache)
+    """
+    def __init__(self, path="~/.cache/opencv_camera", source=None):
+        path = Path(path).expanduser().resolve()
+
+        if source is not None:
+            source = Path(source).expanduser().resolve()
+            name = hashlib.sha1(str(source).encode()).hexdigest()[:16]
+            path = path / name
+
+        path.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.source = source
+
+    def key(self, K, d, R, size, alpha, m1type):
+        """Returns a hex string unique to the calibration and map settings"""
+        h = hashlib.sha1()
+        for m in (K, d, R):
+            if m is None:
+                h.update(b"None")
+            else:
+                h.update(np.ascontiguousarray(m, dtype=np.float64).tobytes())
+        h.update(repr((tuple(size), float(alpha), int(m1type))).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        """Returns the memory mapped (map1, map2) for key or None"""
+        self._validate()
+
+        files = self._files(key)
+        try:
+            return tuple(np.load(f, mmap_mode="r") for f in files)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, map1, map2):
+        """Saves the maps and returns them memory mapped from disk"""
+        self._validate()
+
+        # write to a temp file and rename so other processes never see a
+        # partially written map
+        for f, m in zip(self._files(key), (map1, map2)):
+            tmp = f.with_name(f"{f.stem}.{os.getpid()}.tmp.npy")
+            np.save(tmp, m)
+            os.replace(tmp, f)
+
+        return self.get(key)
+
+    def clear(self):
+        """Deletes all of the maps in the cache"""
+        for f in self.path.glob("*.npy"):
+            f.unlink(missing_ok=True)
+
+    def _files(self, key):
+        return (self.path / f"{key}.map1.npy", self.path / f"{key}.map2.npy")
+
+    def _validate(self):
+        """
+        Clears the cache if the calibration source file changed. A source
+        that was removed counts as a change, the maps are just built again.
+        """
+        if self.source is None:
+            return
+
+        try:
+            st = self.source.stat()
+            stamp = f"{st.st_mtime_ns} {st.st_size}"
+        except FileNotFoundError:
+            stamp = ""
+
+        fstamp = self.path / "source.stamp"
+        try:
+            old = fstamp.read_text()
+        except FileNotFoundError:
+            old = None
+
+        if old != stamp:
+            self.clear()
+            fstamp.write_text(stamp)
@@ -9,7 +9,133 @@ np.set_printoptions(precision=3)
 np.set_printoptions(suppress=True)
 import cv2
 import time # date saved in output
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from glob import glob
+from pathlib import Path
 from ..color_space import bgr2gray, gray2bgr
+from ..blurry import isBlurry
+from .select_views import selectViews
+
+
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp", ".pgm", ".ppm"]
+
+
+def imageSource(images):
+    """
+    Returns something to iterate over for calibration without loading all of
+    the images into memory.
+
+    images: one of
+        - a directory, all of the images in it are used in sorted order
+        - a glob pattern, ex: "~/cal/left*.png"
+        - any list, iterable or generator of images or image file names
+
+    File names are only read when they are needed, see detect().
+    """
+    if isinstance(images, (str, Path)):
+        p = Path(images).expanduser()
+        if p.is_dir():
+            files = sorted(f for f in p.iterdir() if f.suffix.lower() in IMAGE_EXTENSIONS)
+        else:
+            files = sorted(glob(str(p)))
+        return [str(f) for f in files]
+
+    return images
+
+
+def detect(board, image):
+    """
+    Finds the target in one image and refines the corners to subpixel
+    accuracy. This is a plain function so it can run in another process.
+
+    board: an object that represents your target, i.e., Chessboard
+    image: grayscale or BGR image, or an image file name which is read
+        (as grayscale) here and released when done
+
+    return: ok, objpoints (N,3), imgpoints (N,2), ids, image shape (h,w),
+        sharpness of the board (see isBlurry())
+    """
+    if isinstance(image, (str, Path)):
+        gray = cv2.imread(str(image), cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            return False, None, None, None, None, None
+    else:
+        gray = image
+
+    if len(gray.shape) > 2:
+        gray = bgr2gray(gray)
+    shape = gray.shape[:2]
+
+    ok, corners, objp, ids = board.find(gray)
+    if not ok:
+        return False, None, None, None, shape, None
+
+    term = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 30, 0.001)
+    corners = cv2.cornerSubPix(gray, corners, (5, 5), (-1, -1), term)
+    corners = corners.reshape(-1, 2)
+
+    # only the board matters, not the background
+    x, y, bw, bh = cv2.boundingRect(corners)
+    _, sharpness = isBlurry(gray[y:y+bh, x:x+bw])
+
+    return True, objp, corners, ids, shape, sharpness
+
+
+def detectCached(board, images, cache, workers=None):
+    """
+    Generator of detect() results for images, in order. Images already in
+    the cache are answered here and never sent to a worker process, only the
+    rest are searched (see imap()) and added to the cache.
+    """
+    order = deque() # cached result of each image, None if it is searched
+    keys = deque()  # cache key of each searched image
+
+    def misses():
+        for im in images:
+            key = cache.key(board, im)
+            cached = cache.get(key)
+            order.append(cached)
+            if cached is None:
+                keys.append(key)
+                yield im
+
+    func = partial(detect, board)
+    if workers is None or workers <= 1:
+        found = map(func, misses())
+    else:
+        found = imap(func, misses(), workers)
+
+    # misses() has seen every image up to the one a result is for, so any
+    # cache hits before it are already queued
+    for result in found:
+        while order[0] is not None:
+            yield order.popleft()
+        order.popleft()
+        cache.put(keys.popleft(), result)
+        yield result
+
+    yield from order # hits after the last searched image
+
+
+def imap(func, items, workers):
+    """
+    Like map(func, items) but spread over a pool of worker processes. Results
+    come back in input order as soon as they are ready, and only a few items
+    are in flight at a time, so items can be a generator that loads images
+    while the workers are busy with the previous ones.
+    """
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= 2*workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
 
 
 class CameraCalibration:
@@ -17,64 +143,100 @@ class CameraCalibration:
     Simple calibration class.
     '''
 
-    def findPoints(self, images, board):
+    def findPoints(self, images, board, workers=None, cache=None):
+        """
+        Finds the target in each image
+
+        images: grayscale or BGR images, or anything imageSource() takes
+        board: an object that represents your target, i.e., Chessboard
+        workers: number of processes to search the images with, None or 1
+            searches them here, 0 uses every cpu core
+        cache: optional DetectionCache, images already in it are not searched
+            again
+        """
+        objpoints, imgpoints, tagids, _, _, _ = self._findPoints(images, board, workers, cache)
+        return objpoints, imgpoints, tagids
+
+    def _findPoints(self, images, board, workers, cache=None):
+        """
+        findPoints() that also returns the index of each image the target was
+        found in, the image shape (h,w) and the sharpness of each view
+        """
 
         # Arrays to store object points and image points from all the images.
         objpoints = []  # 3d point in real world space
         imgpoints = []  # 2d points in image plane.
-        bad_images = [] # keep track of what images failed
+        index = []      # which images the target was found in
+        sharpness = []  # how sharp the board is in each image
+        shape = None
 
         if board.has_ids is True:
             tagids = []
         else:
             tagids = None
 
-        max_corners = board.marker_size[0]*board.marker_size[1]
+        if workers == 0:
+            workers = os.cpu_count()
+
+        images = imageSource(images)
+        if cache is not None:
+            found = detectCached(board, images, cache, workers)
+        elif workers is None or workers <= 1:
+            found = map(partial(detect, board), images)
+        else:
+            found = imap(partial(detect, board), images, workers)
 
-        for cnt, gray in enumerate(images):
-            if len(gray.shape) > 2:
-                gray = bgr2gray(gray)
+        # only the points are kept, each image is dropped once searched
+        for cnt, result in enumerate(found):
+            ok, objp, corners, ids, sh, sharp = result
+            if shape is None:
+                shape = sh
 
-            ok, corners, objp, ids = board.find(gray)
             if not ok:
-                # bad_images.append(cnt)
                 continue
 
-            # print("board.find",ok, type(corners), len(corners), corners[0].shape, type(objp),len(objp), objp[0].shape)
-
+            index.append(cnt)
+            sharpness.append(sharp)
             objpoints.append(objp)
+            imgpoints.append(corners)
 
             if tagids is not None:
                 tagids.append(ids)
 
-            term = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 30, 0.001)
-            corners = cv2.cornerSubPix(gray, corners, (5, 5), (-1, -1), term)
-            # print("corners",corners.shape)
-            imgpoints.append(corners.reshape(-1, 2))
-
         # M: number of images
         # N: number of tags found
         # tagids: list of list of ids, (M,N)
         # objpoints: list of list of 3D corner points, (M,N*4,3)
         # imgpoints: list of list of 2D corner points, (M,N*4,2)
-        return objpoints, imgpoints, tagids
+        if cache is not None:
+            cache.save()
+
+        return objpoints, imgpoints, tagids, index, shape, sharpness
 
-    def calibrate(self, images, board, flags=None):
+    def calibrate(self, images, board, flags=None, workers=None, cache=None, max_views=None):
         """
         images: an array of grayscale images, all assumed to be the same size.
             If images are not grayscale, then assumed to be in BGR format.
+            This can also be a generator, a glob pattern or a directory (see
+            imageSource()), so only one image is in memory at a time.
         board: an object that represents your target, i.e., Chessboard
         marker_scale: how big are your markers in the real world, example:
             checkerboard with sides 2 cm, set marker_scale=0.02 so your T matrix
             comes out in meters
+        workers: number of processes used to find the target, see findPoints()
+        cache: optional DetectionCache, so calibrating again with different
+            flags skips finding the target
+        max_views: if more views than this are found, only calibrate with
+            the most informative ones, see selectViews()
         """
-        objpoints, imgpoints, ids = self.findPoints(images, board)
+        objpoints, imgpoints, ids, index, shape, sharpness = self._findPoints(images, board, workers, cache)
+        if shape is None:
+            raise ValueError("CameraCalibration: no images to calibrate with")
 
         # images size here is backwards: w,h
-        h, w = images[0].shape[:2]
+        h, w = shape
 
         # initial guess for camera matrix
-        # K = None # FIXME
         f = 0.8*w
         cx, cy = w//2, h//2
         K = np.array([
@@ -83,6 +245,74 @@ class CameraCalibration:
             [ 0,  0,  1]
         ])
 
+        return self._solve(objpoints, imgpoints, ids, index, shape, sharpness,
+            board, K, None, flags, max_views)
+
+    def update(self, data, images, board, flags=None, workers=None, cache=None, max_views=None):
+        """
+        Adds new views to a previous calibration instead of starting over.
+        Only the new images are searched for the target, then the camera is
+        calibrated with all of the views, starting from the previous K and d
+        (cv2.CALIB_USE_INTRINSIC_GUESS). Starting close to the answer takes
+        far fewer iterations than the f = 0.8*w guess calibrate() uses.
+
+        data: dict returned by calibrate() or update(), if it has no
+            objpoints/imgpoints only the new views are used and K, d are
+            just the starting guess
+        images: the new images, same as calibrate()
+        board: the same target used for data
+        flags: same as calibrate(), cv2.CALIB_USE_INTRINSIC_GUESS is added
+        workers, cache, max_views: same as calibrate()
+
+        return: updated calibration dict, index is the position of each view
+            with the new images numbered after the previous ones
+        """
+        objpoints, imgpoints, ids, index, shape, sharpness = self._findPoints(images, board, workers, cache)
+
+        h, w = data["height"], data["width"]
+        if shape is not None and tuple(shape) != (h, w):
+            raise ValueError(f"CameraCalibration: new images are {shape}, calibration is {(h, w)}")
+
+        prev_obj = list(data.get("objpoints", []))
+        prev_img = list(data.get("imgpoints", []))
+        prev_index = list(data.get("index", range(len(prev_img))))
+        offset = max(prev_index) + 1 if prev_index else 0
+
+        objpoints = prev_obj + objpoints
+        imgpoints = prev_img + imgpoints
+        index = prev_index + [i + offset for i in index]
+        if ids is not None:
+            ids = list(data.get("ids", [])) + ids
+
+        if len(imgpoints) == 0:
+            raise ValueError("CameraCalibration: no views to calibrate with")
+
+        # previous views have no sharpness, treat them as sharp
+        if sharpness is not None:
+            sharpness = [max(sharpness, default=1)]*len(prev_img) + sharpness
+
+        if flags is None:
+            flags = 0
+        flags |= cv2.CALIB_USE_INTRINSIC_GUESS
+
+        K = np.array(data["K"], dtype=np.float64)
+        d = np.array(data["d"], dtype=np.float64)
+        return self._solve(objpoints, imgpoints, ids, index, (h, w), sharpness,
+            board, K, d, flags, max_views)
+
+    def _solve(self, objpoints, imgpoints, ids, index, shape, sharpness, board, K, d, flags, max_views):
+        """Calibrates from the found points, shared by calibrate() and update()"""
+        h, w = shape
+
+        # calibration time grows with the number of views, drop redundant ones
+        if max_views is not None and len(imgpoints) > max_views:
+            keep = selectViews(imgpoints, shape, max_views, objpoints=objpoints, sharpness=sharpness)
+            objpoints = [objpoints[i] for i in keep]
+            imgpoints = [imgpoints[i] for i in keep]
+            index = [index[i] for i in keep]
+            if ids is not None:
+                ids = [ids[i] for i in keep]
+
         # not sure how much these really help
         if flags is None:
             flags = 0
@@ -94,14 +324,14 @@ class CameraCalibration:
         # print(objpoints[0], imgpoints[0])
 
         rms, K, dist, rvecs, tvecs, stdDeviationsIntrinsics, stdDeviationsExtrinsics, perViewErrors = cv2.calibrateCameraExtended(
-            objpoints, imgpoints, (w, h), K, None)
+            objpoints, imgpoints, (w, h), K, d, flags=flags)
 
         data = {
             'date': time.strftime("%a, %d %b %Y %H:%M:%S", time.localtime()),
             'markerType': board.type,
             'markerSize': board.marker_size,
-            'height': images[0].shape[0],
-            'width': images[0].shape[1],
+            'height': h,
+            'width': w,
             'K': K,
             'd': dist,
             'rms': rms,
@@ -109,12 +339,13 @@ class CameraCalibration:
             'tvecs': tvecs,
             "objpoints": objpoints,
             "imgpoints": imgpoints,
+            "index": index,
             # "badImages": bad_images,
             "stdint": stdDeviationsIntrinsics,
             "stdext": stdDeviationsExtrinsics,
             "perViewErr": perViewErrors,
-            "height": images[0].shape[0],
-            "width": images[0].shape[1]
+            "height": h,
+            "width": w
         }
 
         if board.has_ids is True:
@@ -37,12 +37,14 @@ class Camera:
         s += f'  distortionCoeffs: {self.d}\n'
         return s
 
-    def getUndistortion(self):
+    def getUndistortion(self, fixed_point=False, cache=None):
         return UnDistort(
             self.K,
             self.d,
             self.h,
-            self.w
+            self.w,
+            fixed_point=fixed_point,
+            cache=cache
         )
 
     @classmethod
@@ -0,0 +1,128 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2014 Kevin Walchko
+# see LICENSE for full details
+##############################################
+# -*- coding: utf-8 -*
+import hashlib
+import os
+from pathlib import Path
+from threading import Lock
+import numpy as np
+
+
+def _param(name, value):
+    """
+    Board setting as something with a stable repr(), lists and arrays become
+    tuples. Anything else raises instead of being left out of the key, which
+    would hand back detections made with other settings.
+    """
+    if isinstance(value, (str, int, float, bool, type(None))):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return tuple(_param(name, v) for v in value)
+    raise TypeError(f"DetectionCache: can't key board setting {name}: {type(value).__name__}")
+
+
+class DetectionCache:
+    """
+    Keeps the target detections of calibration images in a binary .npz file,
+    so calibrating again with different flags or distortion models doesn't
+    search every image again.
+
+    An entry is keyed by a hash of the image and the board settings (size,
+    scale, flags, ...), so changing either one is a miss. For image file
+    names, the file bytes are hashed, which is much faster than decoding them.
+    Images where the target was not found are remembered too. One cache can
+    be shared by threads, ex: the left and right calibrations in
+    StereoCalibration.
+
+    cache = DetectionCache("detections.npz")
+    data = cal.calibrate("cal/*.png", board, cache=cache)  # searches images
+    data = cal.calibrate("cal/*.png", board, flags=cv2.CALIB_RATIONAL_MODEL,
+        cache=cache)                                         # no searching
+    """
+    def __init__(self, filename):
+        self.filename = Path(filename).expanduser().resolve()
+        self.entries = {}
+        self.dirty = False
+        self.lock = Lock()
+
+        if self.filename.exists():
+            with np.load(self.filename) as f:
+                self.entries = {k: f[k] for k in f.files}
+
+    def __len__(self):
+        return len({k.split(".")[0] for k in self.entries})
+
+    def __contains__(self, key):
+        return f"{key}.shape" in self.entries
+
+    def key(self, board, image):
+        """Returns a hex string unique to the image and board settings"""
+        h = hashlib.sha1()
+
+        if isinstance(image, (str, Path)):
+            h.update(Path(image).read_bytes())
+        else:
+            image = np.ascontiguousarray(image)
+            h.update(repr((image.shape, image.dtype.str)).encode())
+            h.update(image.data)
+
+        # every board setting, later options are picked up automatically.
+        # Functions (ex: a wrapped find()) aren't settings
+        params = sorted(
+            (k, _param(k, v)) for k, v in vars(board).items() if not callable(v)
+        )
+        h.update(repr((type(board).__name__, params)).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        """Returns the detect() result for key or None"""
+        if key not in self:
+            return None
+
+        shape = tuple(int(x) for x in self.entries[f"{key}.shape"])
+        if f"{key}.imgpoints" not in self.entries:
+            return False, None, None, None, shape, None
+
+        objp = self.entries[f"{key}.objpoints"]
+        imgp = self.entries[f"{key}.imgpoints"]
+        ids = self.entries.get(f"{key}.ids")
+        sharpness = self.entries.get(f"{key}.sharpness")
+        if sharpness is not None:
+            sharpness = int(sharpness)
+        return True, objp, imgp, ids, shape, sharpness
+
+    def put(self, key, result):
+        """Saves a detect() result for key"""
+        ok, objp, imgp, ids, shape, sharpness = result
+        if shape is None:
+            return # couldn't read the image, nothing to remember
+
+        entries = {f"{key}.shape": np.array(shape)}
+        if ok:
+            entries[f"{key}.objpoints"] = np.asarray(objp, dtype=np.float32)
+            entries[f"{key}.imgpoints"] = np.asarray(imgp, dtype=np.float32)
+            if ids is not None:
+                entries[f"{key}.ids"] = np.asarray(ids)
+            if sharpness is not None:
+                entries[f"{key}.sharpness"] = np.asarray(sharpness)
+
+        with self.lock:
+            self.entries.update(entries)
+            self.dirty = True
+
+    def save(self):
+        """Writes the cache to disk if anything changed"""
+        with self.lock:
+            if not self.dirty:
+                return
+
+            self.filename.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.filename.with_name(f"{self.filename.stem}.{os.getpid()}.tmp.npz")
+            np.savez(tmp, **self.entries)
+            os.replace(tmp, self.filename)
+            self.dirty = False
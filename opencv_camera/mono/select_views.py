@@ -0,0 +1,127 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2014 Kevin Walchko
+# see LICENSE for full details
+##############################################
+# -*- coding: utf-8 -*
+import cv2
+import numpy as np
+
+
+def boardPoses(objpoints, imgpoints, size):
+    """
+    Rough pose of the target in each view from cv2.solvePnP() with a guessed
+    camera matrix (f = 0.8*w, no distortion). Good enough to tell views apart.
+
+    size: image size (h,w)
+    return: rvecs, tvecs
+    """
+    h, w = size
+    f = 0.8*w
+    K = np.array([
+        [ f,  0, w/2],
+        [ 0,  f, h/2],
+        [ 0,  0,   1]
+    ])
+
+    rvecs, tvecs = [], []
+    for o, p in zip(objpoints, imgpoints):
+        o = np.asarray(o, dtype=np.float64).reshape(-1,3)
+        p = np.asarray(p, dtype=np.float64).reshape(-1,2)
+        _, r, t = cv2.solvePnP(o, p, K, None)
+        rvecs.append(r)
+        tvecs.append(t)
+    return rvecs, tvecs
+
+
+def selectViews(imgpoints, size, max_views, objpoints=None, rvecs=None, tvecs=None,
+        sharpness=None, grid=(12,16), weights=(1.0, 1.0, 0.25)):
+    """
+    Picks the max_views most informative calibration views. Views are chosen
+    one at a time (greedy), each time taking the view that adds the most:
+
+        coverage: fraction of the image grid cells that no chosen view has a
+            point in yet, corners of the image matter most for distortion
+        pose: how different the board tilt and distance is from the closest
+            chosen view, the focal length needs boards at many angles
+        sharpness: how sharp the board is compared to the sharpest view,
+            from isBlurry()
+
+    Greedy selection of coverage is within (1 - 1/e) of the best possible
+    subset. Calibrating on the subset usually gives about the same RMS as all
+    of the views in a fraction of the time.
+
+    imgpoints: detected 2D image points of each view
+    size: image size (h,w)
+    max_views: number of views to keep
+    objpoints: 3D target points of each view, used to find the board poses
+        if rvecs/tvecs are not given
+    rvecs/tvecs: board pose of each view, ex: from a previous calibration
+    sharpness: sharpness of each view (bigger is sharper), ex: isBlurry()[1]
+    grid: (rows, cols) of image cells used for coverage
+    weights: (coverage, pose, sharpness) weights of the score
+
+    return: sorted list of the chosen view indexes
+    """
+    num = len(imgpoints)
+    if num <= max_views:
+        return list(range(num))
+
+    h, w = size
+    rows, cols = grid
+    wc, wp, ws = weights
+
+    # cells each view covers
+    cells = []
+    for p in imgpoints:
+        p = np.asarray(p).reshape(-1,2)
+        r = np.clip((p[:,1]*rows/h).astype(int), 0, rows - 1)
+        c = np.clip((p[:,0]*cols/w).astype(int), 0, cols - 1)
+        cell = np.zeros(rows*cols, dtype=bool)
+        cell[r*cols + c] = True
+        cells.append(cell)
+    cells = np.array(cells)
+
+    # board normal (z axis of the board in the camera frame) and distance,
+    # log distance since farther boards differ less
+    if (rvecs is None or tvecs is None) and objpoints is not None:
+        rvecs, tvecs = boardPoses(objpoints, imgpoints, size)
+
+    if rvecs is None or tvecs is None:
+        normals = np.zeros((num,3))
+        dist = np.zeros(num)
+        wp = 0
+    else:
+        normals = np.array([cv2.Rodrigues(np.asarray(r, dtype=np.float64))[0][:,2] for r in rvecs])
+        dist = np.log(np.maximum([np.linalg.norm(t) for t in tvecs], 1e-9))
+
+    if sharpness is None:
+        sharp = np.ones(num)
+    else:
+        sharp = np.asarray(sharpness, dtype=np.float64)
+        sharp = sharp / max(sharp.max(), 1e-9)
+
+    covered = np.zeros(rows*cols, dtype=bool)
+    pose = np.ones(num) # distance to the closest chosen pose, in [0,1]
+    chosen = []
+    available = np.ones(num, dtype=bool)
+
+    for _ in range(max_views):
+        # new cells, scaled so the best view gets 1 like the other terms
+        gain = (cells & ~covered).sum(axis=1).astype(np.float64)
+        gain[~available] = 0
+        gain /= max(gain.max(), 1)
+        score = wc*gain + wp*pose + ws*sharp
+        score[~available] = -np.inf
+
+        i = int(np.argmax(score))
+        chosen.append(i)
+        available[i] = False
+        covered |= cells[i]
+
+        # angle between normals (up to 90 deg) and log distance ratio
+        angle = np.arccos(np.clip(np.abs(normals @ normals[i]), 0, 1)) / (np.pi/2)
+        d = np.minimum(np.abs(dist - dist[i]), 1)
+        pose = np.minimum(pose, np.maximum(angle, d))
+
+    return sorted(chosen)
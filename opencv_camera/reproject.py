@@ -9,12 +9,38 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 
+def rodrigues(rvecs):
+    """
+    Vectorized cv2.Rodrigues(), turns (N,3) rotation vectors into (N,3,3)
+    rotation matrices.
+    """
+    rvecs = np.asarray(rvecs, dtype=np.float64).reshape(-1,3)
+    theta = np.linalg.norm(rvecs, axis=1)
+    k = rvecs / np.where(theta > 0, theta, 1)[:,None]
+
+    kx = np.zeros((len(k),3,3))
+    kx[:,0,1] = -k[:,2]
+    kx[:,0,2] =  k[:,1]
+    kx[:,1,0] =  k[:,2]
+    kx[:,1,2] = -k[:,0]
+    kx[:,2,0] = -k[:,1]
+    kx[:,2,1] =  k[:,0]
+
+    s = np.sin(theta)[:,None,None]
+    c = np.cos(theta)[:,None,None]
+    return np.eye(3) + s*kx + (1 - c)*(kx @ kx)
+
+
 def computeReprojectionErrors(imgpoints, objpoints, rvecs, tvecs, K, D):
     """
     Uses the camera matrix (K) and the distortion coefficients to reproject the
     object points back into 3D camera space and then calculate the error between
     them and the image points that were found.
 
+    All of the views are done at once: the object points are moved into the
+    camera frame with numpy and then projected with a single
+    cv2.projectPoints() call.
+
     Reference: https://docs.opencv.org/master/dc/dbb/tutorial_py_calibration.html
 
     imgpoints: features found in image, (num_imgs, 2)
@@ -25,43 +51,63 @@ def computeReprojectionErrors(imgpoints, objpoints, rvecs, tvecs, K, D):
     D: distortion coefficients [k1,k2,p1,p2,k3]
 
     returns:
-        rms
-        rms_per_view
-        errors
+        rms: over all points
+        rms_per_view: array (num_views,), nan for a view without points
+        errors: array (num_points, 2) of reprojected - found image points,
+            views are in order
+        counts: array (num_views,) of points per view, split errors into
+            views with np.split(errors, np.cumsum(counts)[:-1])
+
+    Views where not all of the markers were found are left out of all of
+    the returned arrays.
     """
-    imgpoints = [c.reshape(-1,2) for c in imgpoints]
-    mean_error = None
-    error_x = []
-    error_y = []
-    rms = []
-    for i in range(len(objpoints)):
-        imgpoints2, _ = cv2.projectPoints(objpoints[i], rvecs[i], tvecs[i], K, D)
-        imgpoints2 = imgpoints2.reshape(-1,2)
+    imgpoints = [np.asarray(c, dtype=np.float64).reshape(-1,2) for c in imgpoints]
+    objpoints = [np.asarray(c, dtype=np.float64).reshape(-1,3) for c in objpoints]
 
-        # if not all markers were found, then the norm below will fail
-        if len(imgpoints[i]) != len(imgpoints2):
-            continue
+    # if not all markers were found, then the errors can't be computed
+    keep = [i for i, (o, p) in enumerate(zip(objpoints, imgpoints)) if len(o) == len(p)]
+    counts = np.array([len(objpoints[i]) for i in keep], dtype=int)
+    if counts.sum() == 0:
+        return np.nan, np.full(len(keep), np.nan), np.zeros((0,2)), counts
 
-        error_x.append(list(imgpoints2[:,0] - imgpoints[i][:,0]))
-        error_y.append(list(imgpoints2[:,1] - imgpoints[i][:,1]))
+    view = np.repeat(np.arange(len(keep)), counts)
 
-        rr = np.sum((imgpoints2 - imgpoints[i])**2, axis=1)
-        if mean_error is None:
-            mean_error = rr
-        else:
-            mean_error = np.hstack((mean_error, rr))
-        rr = np.sqrt(np.mean(rr))
-        rms.append(rr)
+    R = rodrigues(np.array([np.ravel(rvecs[i]) for i in keep]))
+    t = np.array([np.ravel(tvecs[i]) for i in keep])
 
-    m_error = np.sqrt(np.mean(mean_error))
-    return m_error, rms, [error_x, error_y]
+    pts = np.concatenate([objpoints[i] for i in keep])
+    pts = np.einsum("nij,nj->ni", R[view], pts) + t[view]
 
+    zero = np.zeros(3)
+    proj, _ = cv2.projectPoints(pts, zero, zero, K, D)
 
+    errors = proj.reshape(-1,2) - np.concatenate([imgpoints[i] for i in keep])
+    sq = np.sum(errors**2, axis=1)
 
-def visualizeReprojErrors(totalRSME, rmsPerView, reprojErrs, fontSize=16,legend=False,xlim=None,ylim=None):
+    # bincount instead of reduceat, which gets views without points wrong
+    total = np.bincount(view, weights=sq, minlength=len(keep))
+    rms = np.full(len(keep), np.nan)
+    np.sqrt(np.divide(total, counts, out=rms, where=counts > 0), out=rms, where=counts > 0)
+
+    m_error = np.sqrt(np.mean(sq))
+    return m_error, rms, errors, counts
+
+
+
+def visualizeReprojErrors(totalRSME, rmsPerView, reprojErrs, fontSize=16,legend=False,xlim=None,ylim=None,counts=None):
+    """
+    Plots the output of computeReprojectionErrors(). Pass its counts so the
+    errors are split into the right views, without them every view is assumed
+    to have the same number of points (a chessboard where every view has all
+    of the corners).
+    """
     fig, ax = plt.subplots()
-    for i,(rms,x,y) in enumerate(zip(rmsPerView,reprojErrs[0],reprojErrs[1])):
-        ax.scatter(x,y,label=f"RMSE [{i}]: {rms:0.3f}")
+    if counts is None:
+        views = np.array_split(reprojErrs, len(rmsPerView))
+    else:
+        views = np.split(reprojErrs, np.cumsum(counts)[:-1])
+    for i,(rms,err) in enumerate(zip(rmsPerView,views)):
+        ax.scatter(err[:,0],err[:,1],label=f"RMSE [{i}]: {rms:0.3f}")
 
     # change dimensions if legend displayed
     if legend:
@@ -4,9 +4,9 @@
 # see LICENSE for full details
 ##############################################
 # -*- coding: utf-8 -*
+from pathlib import Path
 import numpy as np
 
-# FIXME: add pathlib here to handle home folder (~)
 
 ply_header = '''ply
 format ascii 1.0
@@ -20,12 +20,159 @@ property uchar blue
 end_header
 '''
 
+# one binary PLY vertex, written to disk as is
+PLY_DTYPE = np.dtype([
+    ("x", "<f4"), ("y", "<f4"), ("z", "<f4"),
+    ("red", "u1"), ("green", "u1"), ("blue", "u1")
+])
+
+# PLY property types
+PLY_TYPES = {
+    "char": "i1", "uchar": "u1", "short": "i2", "ushort": "u2",
+    "int": "i4", "uint": "u4", "float": "f4", "double": "f8",
+    "int8": "i1", "uint8": "u1", "int16": "i2", "uint16": "u2",
+    "int32": "i4", "uint32": "u4", "float32": "f4", "float64": "f8"
+}
+
+COUNT_WIDTH = 12 # digits saved for the vertex count of a streamed file
+
+
+def vertices(verts, colors):
+    """Returns the structured PLY_DTYPE array of points (N,3) and colors (N,3)"""
+    verts = np.asarray(verts).reshape(-1, 3)
+    colors = np.asarray(colors).reshape(-1, 3)
+    v = np.empty(len(verts), dtype=PLY_DTYPE)
+    v["x"], v["y"], v["z"] = verts.T
+    v["red"], v["green"], v["blue"] = colors.T
+    return v
+
+
+def binaryHeader(count):
+    """Header of a binary PLY file of PLY_DTYPE vertices"""
+    return (ply_header % dict(vert_num=0)).replace(
+        "format ascii", "format binary_little_endian").replace(
+        "element vertex 0", f"element vertex {count}")
+
+
+class PLYWriter:
+    """
+    Streams points to a binary PLY file a chunk at a time, so a large cloud
+    never has to be in memory at once. The vertex count in the header is
+    written as a fixed width number and filled in by close().
+
+    with PLY().open("cloud.ply") as ply:
+        for left, right in frames:
+            ply.append(*pc.reproject(left, pc.to_pc(left, right)))
+    """
+    def __init__(self, fn):
+        self.file = open(Path(fn).expanduser(), "wb")
+        self.count = 0
+
+        header = binaryHeader("0"*COUNT_WIDTH).encode()
+        self.offset = header.index(b"element vertex ") + len(b"element vertex ")
+        self.file.write(header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def append(self, verts, colors):
+        """Writes points (N,3) and their colors (N,3) to the end of the file"""
+        v = vertices(verts, colors)
+        v.tofile(self.file)
+        self.count += len(v)
+
+    def close(self):
+        """Writes the vertex count to the header and closes the file"""
+        f = getattr(self, "file", None)
+        if f is None or f.closed:
+            return
+        f.seek(self.offset)
+        f.write(f"{self.count:0{COUNT_WIDTH}d}".encode())
+        f.close()
+
 
 class PLY:
-    def write(self, fn, verts, colors):
-        verts = verts.reshape(-1, 3)
-        colors = colors.reshape(-1, 3)
-        verts = np.hstack([verts, colors])
-        with open(fn, 'w') as f:
-            f.write(ply_header % dict(vert_num=len(verts)))
-            np.savetxt(f, verts, '%f %f %f %d %d %d')
+    def write(self, fn, verts, colors, binary=True):
+        """
+        Saves a colored point cloud
+
+        fn: file name
+        verts: points (N,3)
+        colors: RGB colors (N,3) uint8
+        binary: little endian binary, a third the size of ascii and much
+            faster, False writes the old ascii format
+        """
+        fn = Path(fn).expanduser()
+
+        if not binary:
+            verts = verts.reshape(-1, 3)
+            colors = colors.reshape(-1, 3)
+            verts = np.hstack([verts, colors])
+            with open(fn, 'w') as f:
+                f.write(ply_header % dict(vert_num=len(verts)))
+                np.savetxt(f, verts, '%f %f %f %d %d %d')
+            return
+
+        v = vertices(verts, colors)
+        with open(fn, "wb") as f:
+            f.write(binaryHeader(len(v)).encode())
+            v.tofile(f)
+
+    def open(self, fn):
+        """Returns a PLYWriter to stream points into fn"""
+        return PLYWriter(fn)
+
+    def read(self, fn):
+        """
+        Reads the vertices of a binary or ascii PLY file
+
+        return: points (N,3) float32, colors (N,3) uint8 or None if the file
+            has no colors
+        """
+        with open(Path(fn).expanduser(), "rb") as f:
+            if f.readline().strip() != b"ply":
+                raise ValueError(f"PLY: not a ply file: {fn}")
+
+            fmt, count, props, element = None, 0, [], None
+            for line in iter(f.readline, b""):
+                words = line.decode("ascii").split()
+                if not words or words[0] in ["comment", "obj_info"]:
+                    continue
+                if words[0] == "end_header":
+                    break
+                elif words[0] == "format":
+                    fmt = words[1]
+                elif words[0] == "element":
+                    element = words[1]
+                    if element == "vertex":
+                        count = int(words[2])
+                    elif count == 0:
+                        raise ValueError("PLY: only files that start with vertices are supported")
+                elif words[0] == "property" and element == "vertex":
+                    if words[1] == "list":
+                        raise ValueError("PLY: list vertex properties are not supported")
+                    props.append((words[2], PLY_TYPES[words[1]]))
+
+            if fmt == "ascii":
+                data = np.loadtxt(f, max_rows=count, ndmin=2)
+                data = np.rec.fromarrays(data.T[:len(props)], names=[n for n, _ in props])
+            elif fmt in ["binary_little_endian", "binary_big_endian"]:
+                e = "<" if fmt == "binary_little_endian" else ">"
+                dtype = np.dtype([(n, e + t) for n, t in props])
+                data = np.fromfile(f, dtype=dtype, count=count)
+            else:
+                raise ValueError(f"PLY: unknown format: {fmt}")
+
+        verts = np.stack([data["x"], data["y"], data["z"]], axis=1).astype(np.float32)
+        names = [n for n, _ in props]
+        if all(c in names for c in ["red", "green", "blue"]):
+            colors = np.stack([data["red"], data["green"], data["blue"]], axis=1).astype(np.uint8)
+        else:
+            colors = None
+        return verts, colors
@@ -0,0 +1,247 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2014 Kevin Walchko
+# see LICENSE for full details
+##############################################
+# -*- coding: utf-8 -*
+from multiprocessing import shared_memory, resource_tracker
+import time
+import numpy as np
+
+
+MAGIC = 0x4f43564652414d45 # "OCVFRAME"
+HEADER_SIZE = 128          # bytes, 16 int64
+ALIGN = 64                 # frame slots start on a cache line
+
+# header fields (int64 index)
+_MAGIC, _CAPACITY, _NDIM, _SHAPE, _DTYPE, _HEAD = 0, 1, 2, 3, 6, 7
+
+
+def _layout(capacity, nbytes):
+    """Returns the byte offsets of the slot seqs, timestamps, data and the total size"""
+    seqs = HEADER_SIZE
+    stamps = seqs + 8*capacity
+    data = stamps + 8*capacity
+    data = -(-data // ALIGN)*ALIGN
+    slot = -(-nbytes // ALIGN)*ALIGN
+    return seqs, stamps, data, slot, data + capacity*slot
+
+
+def _attach(name):
+    """Opens an existing shared memory block without taking ownership of it"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # python 3.13+
+    except TypeError:
+        pass
+
+    # older pythons register every attach with the resource tracker, which
+    # deletes the block when this process exits. Unregistering afterwards
+    # doesn't work either, forked processes share the publisher's tracker.
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class SharedFrames:
+    """Numpy views of the header, slot seqs, timestamps and frames in a block"""
+    def __init__(self, shm, capacity, shape, dtype):
+        nbytes = int(np.prod(shape))*np.dtype(dtype).itemsize
+        seqs, stamps, data, slot, _ = _layout(capacity, nbytes)
+        buf = shm.buf
+
+        self.shm = shm
+        self.capacity = capacity
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.header = np.ndarray((HEADER_SIZE//8,), np.int64, buf)
+        self.seqs = np.ndarray((capacity,), np.int64, buf, seqs)
+        self.stamps = np.ndarray((capacity,), np.float64, buf, stamps)
+        self.slots = [
+            np.ndarray(self.shape, self.dtype, buf, data + i*slot)
+            for i in range(capacity)
+        ]
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def head(self):
+        """Sequence number of the newest frame, -1 if there are none"""
+        return int(self.header[_HEAD])
+
+    def release(self):
+        """Drops the numpy views so the block can be closed"""
+        self.header = self.seqs = self.stamps = self.slots = None
+
+
+class FramePublisher(SharedFrames):
+    """
+    Writes frames into a ring of slots in a shared memory block that any
+    number of FrameSubscribers in other processes read without copying or
+    pickling. Frames are published with the same seqlock as FrameRing: a
+    slot's sequence number is -1 while it is being written, so a reader can
+    tell a frame was overwritten while it used it.
+
+    pub = FramePublisher((1080,1920,3), np.uint8, name="front")
+    pub.attach(camera)        # publish every ThreadedCamera frame
+    ...
+    pub.close()               # and unlink() when everyone is done
+    """
+    def __init__(self, shape, dtype=np.uint8, capacity=8, name=None):
+        """
+        shape: frame shape, ex: (480,640,3)
+        dtype: frame data type
+        capacity: frames kept, a subscriber's zero copy view is good until
+            capacity-1 newer frames are published
+        name: shared memory block name, default is a random one (see .name)
+        """
+        if capacity < 2:
+            raise ValueError(f"FramePublisher: capacity must be at least 2: {capacity}")
+
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape))*dtype.itemsize
+        size = _layout(capacity, nbytes)[-1]
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        super().__init__(shm, capacity, shape, dtype)
+
+        h = self.header
+        h[:] = 0
+        h[_CAPACITY] = capacity
+        h[_NDIM] = len(shape)
+        h[_SHAPE:_SHAPE + len(shape)] = shape
+        h[_DTYPE] = ord(dtype.char)
+        h[_HEAD] = -1
+        self.seqs[:] = -1
+        h[_MAGIC] = MAGIC # last, the block is ready
+        self.camera = None
+
+    def publish(self, image, timestamp=None):
+        """
+        Copies image into the next slot and returns its sequence number
+
+        timestamp: capture time, default is time.monotonic()
+        """
+        if image.shape != self.shape:
+            raise ValueError(f"FramePublisher: frame is {image.shape}, expected {self.shape}")
+        if image.dtype != self.dtype:
+            raise ValueError(f"FramePublisher: frame is {image.dtype}, expected {self.dtype}")
+
+        seq = self.head + 1
+        i = seq % self.capacity
+
+        self.seqs[i] = -1 # writing
+        np.copyto(self.slots[i], image)
+        self.stamps[i] = time.monotonic() if timestamp is None else timestamp
+        self.seqs[i] = seq
+        self.header[_HEAD] = seq
+        return seq
+
+    def attach(self, camera):
+        """Publishes every frame the ThreadedCamera captures"""
+        self.camera = camera
+        camera.add_callback(self._captured)
+
+    def _captured(self, seq, timestamp, image):
+        self.publish(image, timestamp)
+
+    def close(self):
+        if self.camera is not None:
+            self.camera.remove_callback(self._captured)
+            self.camera = None
+        if self.header is not None:
+            self.release()
+            self.shm.close()
+
+    def unlink(self):
+        """Deletes the shared memory block, call once no one needs it"""
+        self.shm.unlink()
+
+
+class FrameSubscriber(SharedFrames):
+    """
+    Reads the frames of a FramePublisher, usually in another process.
+    get()/latest() return numpy views straight into shared memory, no copy.
+    A view is overwritten once the publisher wraps around the ring, so check
+    valid(seq) after using it, or use copy=True.
+
+    sub = FrameSubscriber("front")
+    seq = -1
+    while True:
+        seq, ts, image = sub.wait(seq, timeout=1)
+        if image is None:
+            continue
+        result = detect(image)
+        if not sub.valid(seq):
+            continue # overwritten while detecting, throw result away
+    """
+    def __init__(self, name):
+        shm = _attach(name)
+        h = np.ndarray((HEADER_SIZE//8,), np.int64, shm.buf)
+        if h[_MAGIC] != MAGIC:
+            del h
+            shm.close()
+            raise ValueError(f"FrameSubscriber: {name} is not a frame publisher")
+
+        capacity = int(h[_CAPACITY])
+        shape = tuple(int(x) for x in h[_SHAPE:_SHAPE + int(h[_NDIM])])
+        dtype = np.dtype(chr(int(h[_DTYPE])))
+        del h
+        super().__init__(shm, capacity, shape, dtype)
+
+    def valid(self, seq):
+        """True if frame seq is still in its slot"""
+        return seq >= 0 and int(self.seqs[seq % self.capacity]) == seq
+
+    def get(self, seq, copy=False):
+        """
+        Returns (timestamp, image) of frame seq, or (None, None) if it is
+        being written or was overwritten
+
+        copy: return a copy instead of a view into shared memory
+        """
+        i = seq % self.capacity
+        if int(self.seqs[i]) != seq:
+            return None, None
+
+        ts = float(self.stamps[i])
+        image = self.slots[i].copy() if copy else self.slots[i]
+
+        # the publisher may have started on the slot while we read it
+        if int(self.seqs[i]) != seq:
+            return None, None
+        return ts, image
+
+    def latest(self, copy=False):
+        """Returns (seq, timestamp, image) of the newest frame, image is None if there isn't one"""
+        for _ in range(self.capacity):
+            seq = self.head
+            if seq < 0:
+                return seq, None, None
+            ts, image = self.get(seq, copy)
+            if image is not None:
+                return seq, ts, image
+        return seq, None, None
+
+    def wait(self, seq=-1, timeout=None, poll=0.001, copy=False):
+        """
+        Waits for a frame newer than seq and returns (seq, timestamp, image)
+        of the newest one, image is None on timeout. There is no way to be
+        woken up across processes without a syscall per frame per reader,
+        so this polls the head every poll seconds.
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        while self.head <= seq:
+            if end is not None and time.monotonic() > end:
+                return seq, None, None
+            time.sleep(poll)
+        return self.latest(copy)
+
+    def close(self):
+        """Detaches, views returned by get()/latest() must be deleted first"""
+        if self.header is not None:
+            self.release()
+            self.shm.close()
@@ -16,6 +16,7 @@ from colorama import Fore
 # from enum import Enum
 import time
 # from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from ..undistort import DistortionCoefficients
 from ..color_space import bgr2gray, gray2bgr
 from ..mono.calibrate import CameraCalibration
@@ -51,62 +52,74 @@ class StereoCalibration(object):
     #     with open(filename, 'wb') as f:
     #         handler.dump(self.camera_model, f)
 
-    def calibrate(self, imgs_l, imgs_r, board, flags=None):
+    def calibrate(self, imgs_l, imgs_r, board, flags=None, workers=None, cache=None,
+            mono=None, verbose=False):
         """
         This will save the found markers for camera_2 (right) only in
         self.save_cal_imgs array
+
+        imgs_l/imgs_r: left/right images, anything CameraCalibration.calibrate()
+            takes, like a glob pattern or a generator. The nth left image is
+            paired with the nth right image.
+        board: an object that represents your target, i.e., Chessboard
+        flags: cv2.stereoCalibrate() flags
+        workers: processes used to find the target in each camera's images
+        cache: optional DetectionCache shared by both cameras
+        mono: optional (left, right) results of CameraCalibration.calibrate()
+            for these images, then neither camera is calibrated again and
+            imgs_l/imgs_r are not used
+        verbose: print the number of views found and paired
         """
-        # so we know a little bit about the camera, so
-        # start off the algorithm with a simple guess
-        # h,w = imgs_l[0].shape[:2]
-        # f = max(h,w)*0.8  # focal length is a function of image size in pixels
-        # K = np.array([
-        #     [f,0,w//2],
-        #     [0,f,h//2],
-        #     [0,0,1]
-        # ])
-
-        cc = CameraCalibration()
-        # rms1, M1, d1, r1, t1, objpoints, imgpoints_l = cc.calibrate(imgs_l, board)
-        # rms2, M2, d2, r2, t2, objpoints, imgpoints_r = cc.calibrate(imgs_r, board)
-
-        data = cc.calibrate(imgs_l, board)
-        K1 = data["K"]
-        d1 = data["d"]
-        rvecs1 = data["rvecs"]
-        tvecs1 = data["tvecs"]
-        objpts = data["objpoints"]
-        imgptsL = data["imgpoints"]
-
-        # print(objpoints)
-
-        # time.sleep(1)
-
-        data = cc.calibrate(imgs_r, board)
-        K2 = data["K"]
-        d2 = data["d"]
-        rvecs2 = data["rvecs"]
-        tvecs2 = data["tvecs"]
-        imgptsR = data["imgpoints"]
-
-        # print(d1,d2)
-
-        # self.save_cal_imgs = cc.save_cal_imgs
-        objpoints = []
-        imgpoints_r = []
-        imgpoints_l = []
-        for o,l,r in zip(objpts,imgptsL,imgptsR):
-            # must have all the same number of points for calibration
-            if o.shape[0] == l.shape[0] == r.shape[0]:
-                objpoints.append(o)
-                imgpoints_r.append(r)
-                imgpoints_l.append(l)
-            else:
-                print("bad points:", o.shape, l.shape, r.shape)
-
-        print(f"Object Pts: {len(objpoints)}")
-        print(f"Left Image Pts: {len(imgpoints_l)}")
-        print(f"Right Image Pts: {len(imgpoints_r)}")
+        if mono is None:
+            # the left and right cameras don't depend on each other, OpenCV
+            # releases the GIL so they really run at the same time
+            cc = CameraCalibration()
+            with ThreadPoolExecutor(2) as ex:
+                futures = [
+                    ex.submit(cc.calibrate, imgs, board, workers=workers, cache=cache)
+                    for imgs in (imgs_l, imgs_r)
+                ]
+                dataL, dataR = [f.result() for f in futures]
+        else:
+            dataL, dataR = mono
+
+        if (dataL["height"], dataL["width"]) != (dataR["height"], dataR["width"]):
+            raise ValueError("StereoCalibration: left and right images are different sizes")
+
+        h, w = dataL["height"], dataL["width"]
+        K1, d1 = dataL["K"], dataL["d"]
+        K2, d2 = dataR["K"], dataR["d"]
+
+        # pair views by the image they came from, the target isn't found in
+        # every image so the nth left view is not always the nth right view
+        idxL = np.asarray(dataL.get("index", range(len(dataL["imgpoints"]))))
+        idxR = np.asarray(dataR.get("index", range(len(dataR["imgpoints"]))))
+        index, li, ri = np.intersect1d(idxL, idxR, return_indices=True)
+
+        # must have all the same number of points for calibration
+        numO = np.array([len(o) for o in dataL["objpoints"]], dtype=int)
+        numL = np.array([len(p) for p in dataL["imgpoints"]], dtype=int)
+        numR = np.array([len(p) for p in dataR["imgpoints"]], dtype=int)
+        good = (numO[li] == numL[li]) & (numL[li] == numR[ri])
+        index, li, ri = index[good], li[good], ri[good]
+
+        if len(index) == 0:
+            raise ValueError("StereoCalibration: no image pairs with the target in both")
+
+        objpoints = [dataL["objpoints"][i] for i in li]
+        imgpoints_l = [dataL["imgpoints"][i] for i in li]
+        imgpoints_r = [dataR["imgpoints"][i] for i in ri]
+        rvecs1 = [dataL["rvecs"][i] for i in li]
+        tvecs1 = [dataL["tvecs"][i] for i in li]
+        rvecs2 = [dataR["rvecs"][i] for i in ri]
+        tvecs2 = [dataR["tvecs"][i] for i in ri]
+
+        if verbose:
+            print(f"Left views: {len(idxL)}")
+            print(f"Right views: {len(idxR)}")
+            print(f"Paired views: {len(index)}")
+            if not good.all():
+                print(f"{Fore.YELLOW}Views with different number of points: {(~good).sum()}{Fore.RESET}")
 
         """
         CALIB_ZERO_DISPARITY: horizontal shift, cx1 == cx2
@@ -133,18 +146,11 @@ class StereoCalibration(object):
             100,
             1e-5)
 
-        for o in objpoints:
-            print(o.shape)
-
-        print("objpoints",type(objpoints),len(objpoints),objpoints[0].shape)
-        print("imgpoints_l",type(imgpoints_l),len(imgpoints_l),imgpoints_l[0].shape)
-        print("imgpoints_r",type(imgpoints_r),len(imgpoints_r),imgpoints_r[0].shape)
-
-        cv2.utils.dumpInputArrayOfArrays(objpoints)
-        cv2.utils.dumpInputArrayOfArrays(imgpoints_l)
-        cv2.utils.dumpInputArrayOfArrays(imgpoints_r)
+        if verbose:
+            cv2.utils.dumpInputArrayOfArrays(objpoints)
+            cv2.utils.dumpInputArrayOfArrays(imgpoints_l)
+            cv2.utils.dumpInputArrayOfArrays(imgpoints_r)
 
-        h,w = imgs_l[0].shape[:2]
         ret, K1, d1, K2, d2, R, T, E, F = cv2.stereoCalibrate(
             objpoints,
             imgpoints_l,
@@ -168,7 +174,7 @@ class StereoCalibration(object):
             'date': time.strftime("%a, %d %b %Y %H:%M:%S", time.localtime()),
             'markerType': board.type,
             'markerSize': board.marker_size,
-            'imageSize': imgs_l[0].shape[:2],
+            'imageSize': (h, w),
             'K1': K1,
             'K2': K2,
             'd1': d1,
@@ -184,6 +190,7 @@ class StereoCalibration(object):
             "objpoints": objpoints,
             "imgpointsL": imgpoints_l,
             "imgpointsR": imgpoints_r,
+            "index": index.tolist(),
         }
 
         return ret, camera_model
@@ -16,9 +16,9 @@ class UndistortStereo:
     Simple class that hold the information to undistort
     a stereo image pair.
     """
-    def __init__(self, K1, d1, K2,d2, h, w, R):
-        self.left = UnDistort(K1,d1,h,w)
-        self.right = UnDistort(K2,d2,h,w,R)
+    def __init__(self, K1, d1, K2,d2, h, w, R, fixed_point=False, cache=None):
+        self.left = UnDistort(K1,d1,h,w,fixed_point=fixed_point,cache=cache)
+        self.right = UnDistort(K2,d2,h,w,R,fixed_point=fixed_point,cache=cache)
 
     def undistort(self, left, right):
         a = self.left.undistort(left)
@@ -121,7 +121,7 @@ class StereoCamera:
         """Returns projection matrix: P2 = K2*[R|t]"""
         return self.K2 @ np.hstack((self.R, self.T.T))
 
-    def getUndistortion(self, h, w):
+    def getUndistortion(self, h, w, fixed_point=False, cache=None):
         # w = self.width
         # h = self.height
         return UndistortStereo(
@@ -130,7 +130,9 @@ class StereoCamera:
             self.K2,
             self.d2,
             h,w,
-            self.R
+            self.R,
+            fixed_point=fixed_point,
+            cache=cache
         )
 
     # def scale(self, scale):
@@ -0,0 +1,186 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2014 Kevin Walchko
+# see LICENSE for full details
+##############################################
+# -*- coding: utf-8 -*
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import math
+import cv2
+import numpy as np
+
+
+ALGORITHMS = ["bm", "sgbm", "sgbm3way"]
+
+
+@dataclass
+class StereoMatcher:
+    """
+    Settings for computing disparity from a rectified stereo pair, and the
+    OpenCV matcher built from them (made once and reused).
+
+        bm: cv2.StereoBM, fastest, noisy, grayscale only
+        sgbm: cv2.StereoSGBM, smoother, much slower
+        sgbm3way: cv2.StereoSGBM with MODE_SGBM_3WAY, close to sgbm quality
+            and a lot faster
+
+    scale matches a copy of the images shrunk by 2 or 4 and scales the
+    disparity back up to full resolution. Matching is about scale**3 faster
+    (fewer pixels and fewer disparities) with 1/scale the depth resolution.
+
+    bands splits the images into this many horizontal bands and matches them
+    at the same time in a thread pool, each band with its own matcher (OpenCV
+    releases the GIL). The bands overlap by overlap rows (default block_size)
+    so every pixel sees a full match window. This helps sgbm the most, bm and
+    sgbm3way already use a few cores on their own. SGBM smooths along paths
+    that are cut at the band edges, a larger overlap makes the seams smaller.
+
+    Disparities are always in full resolution pixels, pixels with no match
+    are less than min_disp.
+
+    m = StereoMatcher.fromDepth(0.1, 500, 0.5, 10, algorithm="sgbm3way", scale=2)
+    disp = m.compute(left, right)
+    """
+    algorithm: str = "sgbm"  # "bm", "sgbm" or "sgbm3way"
+    min_disp: int = 0        # smallest disparity searched, pixels
+    num_disp: int = 64       # number of disparities searched, multiple of 16
+    block_size: int = 5      # match window size, odd
+    scale: int = 1           # match at 1/scale resolution: 1, 2 or 4
+    P1: int = None           # SGBM smoothness, default 8*channels*block_size**2
+    P2: int = None           # SGBM smoothness, default 32*channels*block_size**2
+    uniqueness: int = 10     # 5-15
+    speckle_window: int = 100 # 50-200
+    speckle_range: int = 32
+    disp12_max_diff: int = 1
+    bands: int = 1           # horizontal bands matched in parallel
+    overlap: int = None      # rows shared by neighboring bands, default block_size
+    matcher = None           # OpenCV matcher, built on first compute()
+    matchers = None          # one more per band after the first
+    channels = None          # image channels the matchers were built for
+    pool = None              # band threads
+
+    def __post_init__(self):
+        if self.algorithm not in ALGORITHMS:
+            raise ValueError(f"StereoMatcher: invalid algorithm: {self.algorithm}")
+        if self.scale < 1:
+            raise ValueError(f"StereoMatcher: invalid scale: {self.scale}")
+        if self.bands < 1:
+            raise ValueError(f"StereoMatcher: invalid bands: {self.bands}")
+
+    @classmethod
+    def fromDepth(cls, baseline, focalLength, min_depth, max_depth, **kwargs):
+        """
+        Searches only the disparities of points between min_depth and
+        max_depth away, d = f*b/Z, which is much faster than a wide search.
+
+        baseline: distance between the cameras
+        focalLength: focal length in pixels
+        min_depth/max_depth: same units as the baseline
+        kwargs: any other StereoMatcher setting
+        """
+        fb = abs(baseline*focalLength)
+        lo = int(math.floor(fb/max_depth))
+        hi = int(math.ceil(fb/min_depth))
+        num = 16*max(1, math.ceil((hi - lo + 1)/16))
+        return cls(min_disp=lo, num_disp=num, **kwargs)
+
+    def create(self, channels=1):
+        """Returns a new OpenCV matcher for images with this many channels"""
+        s = self.scale
+        min_disp = self.min_disp // s
+        num_disp = 16*max(1, math.ceil(self.num_disp/(16*s)))
+
+        if self.algorithm == "bm":
+            m = cv2.StereoBM_create(numDisparities=num_disp, blockSize=self.block_size)
+            m.setMinDisparity(min_disp)
+            m.setUniquenessRatio(self.uniqueness)
+            m.setSpeckleWindowSize(self.speckle_window)
+            m.setSpeckleRange(self.speckle_range)
+            m.setDisp12MaxDiff(self.disp12_max_diff)
+            return m
+
+        area = channels*self.block_size**2
+        mode = cv2.StereoSGBM_MODE_SGBM_3WAY if self.algorithm == "sgbm3way" else cv2.StereoSGBM_MODE_SGBM
+        return cv2.StereoSGBM_create(
+            minDisparity = min_disp,
+            numDisparities = num_disp,
+            blockSize = self.block_size,
+            P1 = 8*area if self.P1 is None else self.P1,
+            P2 = 32*area if self.P2 is None else self.P2,
+            disp12MaxDiff = self.disp12_max_diff,
+            uniquenessRatio = self.uniqueness,
+            speckleWindowSize = self.speckle_window,
+            speckleRange = self.speckle_range,
+            mode = mode
+        )
+
+    def compute(self, imgL, imgR):
+        """
+        Returns the float32 disparity of the left image in full resolution
+        pixels
+
+        imgL/imgR: rectified left/right images, grayscale or BGR
+        """
+        if self.algorithm == "bm" and imgL.ndim == 3:
+            imgL = cv2.cvtColor(imgL, cv2.COLOR_BGR2GRAY)
+            imgR = cv2.cvtColor(imgR, cv2.COLOR_BGR2GRAY)
+
+        channels = 1 if imgL.ndim == 2 else imgL.shape[2]
+        if self.matcher is None or self.channels != channels:
+            self.matcher = self.create(channels)
+            self.matchers = [self.matcher]
+            self.channels = channels
+
+        h, w = imgL.shape[:2]
+        s = self.scale
+        if s > 1:
+            size = (w//s, h//s)
+            imgL = cv2.resize(imgL, size, interpolation=cv2.INTER_AREA)
+            imgR = cv2.resize(imgR, size, interpolation=cv2.INTER_AREA)
+
+        if self.bands > 1:
+            disp = self.computeBands(imgL, imgR)
+        else:
+            disp = self.matcher.compute(imgL, imgR)
+
+        if s == 1:
+            return disp.astype(np.float32) / 16.0
+
+        # nearest keeps unmatched pixels from blending into their neighbors
+        disp = cv2.resize(disp, (w, h), interpolation=cv2.INTER_NEAREST)
+        return disp.astype(np.float32) * (s/16.0)
+
+    def computeBands(self, imgL, imgR):
+        """
+        Matches horizontal bands of the images in parallel and stitches the
+        raw (16x fixed point) disparities back together
+        """
+        h = imgL.shape[0]
+        overlap = self.block_size if self.overlap is None else self.overlap
+
+        # bands much thinner than the match window are mostly overlap
+        bands = max(1, min(self.bands, h // max(2*overlap, 16)))
+        while len(self.matchers) < bands:
+            self.matchers.append(self.create(self.channels))
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(self.bands)
+
+        edges = np.linspace(0, h, bands + 1).astype(int)
+        disp = np.empty(imgL.shape[:2], dtype=np.int16)
+
+        def match(i):
+            y0, y1 = edges[i], edges[i + 1]
+            a, b = max(0, y0 - overlap), min(h, y1 + overlap)
+            d = self.matchers[i].compute(imgL[a:b], imgR[a:b])
+            disp[y0:y1] = d[y0 - a:y1 - a]
+
+        for f in [self.pool.submit(match, i) for i in range(bands)]:
+            f.result()
+        return disp
+
+    def close(self):
+        """Stops the band threads"""
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
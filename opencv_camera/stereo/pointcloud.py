@@ -7,10 +7,26 @@
 import cv2
 import numpy as np
 from ..save.pointcloud import PLY
+from .matcher import StereoMatcher
 
 
 class Stereo2PointCloud:
-    def __init__(self, baseline, focalLength, h, w):
+    """
+    Turns a stereo pair into a colored point cloud.
+
+    pc = Stereo2PointCloud(0.1, 500, 480, 640,
+        StereoMatcher.fromDepth(0.1, 500, 0.5, 10, algorithm="sgbm3way"))
+    disp = pc.to_pc(left, right)
+    pts, colors = pc.reproject(left, disp, stride=2, max_depth=10)
+    """
+    def __init__(self, baseline, focalLength, h, w, matcher=None):
+        """
+        baseline: distance between the cameras
+        focalLength: focal length in pixels
+        h, w: image size
+        matcher: StereoMatcher used by to_pc(), ex:
+            StereoMatcher.fromDepth(baseline, focalLength, 0.5, 10, scale=2)
+        """
         # self.baseline = baseline
         # self.f = focalLength
         # self.w = w
@@ -23,73 +39,98 @@ class Stereo2PointCloud:
                         [0, 0, 0,      f],
                         [0, 0,-1/t,    0]])
         self.Q = Q
-        print(Q)
-
-        ch = 3 # channels
-        window_size = 5 # SADWindowSize
-        min_disp = 16*0
-        num_disp = 16*4-min_disp
-#         stereo = cv2.StereoBM_create(numDisparities=96, blockSize=5)
-#         stereo = cv2.StereoSGBM_create(0,64,21)
-        self.matcher = cv2.StereoSGBM_create(
-            minDisparity = min_disp,
-            numDisparities = num_disp,
-            blockSize = 16,          # 3-11
-            P1 = 8*ch*window_size**2,
-            P2 = 32*ch*window_size**2,
-            disp12MaxDiff = 1,
-            uniquenessRatio = 10,    # 5-15
-            speckleWindowSize = 100, # 50-200
-            speckleRange = 32         # 1-2
-        )
 
-    def to_pc(self, imgL, imgR):
-        disp = self.matcher.compute(imgL, imgR).astype(np.float32) / 16.0
-#         disp = stereo.compute(imgR, imgL).astype(np.float32) / 16.0 # <<<<<<<<
-        # dm = (disp-min_disp)/num_disp
-
-        print(f">> Computed disparity, {disp.shape} pts")
-        print(f">> Disparity max: {disp.max()}, min: {disp.min()}")
-        return disp #, dm
+        if matcher is None:
+            # original settings, see StereoMatcher for faster ones
+            ch = 3 # channels
+            window_size = 5 # SADWindowSize
+            matcher = StereoMatcher(
+                algorithm = "sgbm",
+                min_disp = 0,
+                num_disp = 16*4,
+                block_size = 16,
+                P1 = 8*ch*window_size**2,
+                P2 = 32*ch*window_size**2
+            )
+        self.matcher = matcher
+        self.min_disp = matcher.min_disp
+
+        self.buffers = {} # reused per frame, keyed by (rows, cols, stride)
 
-    def reproject(self, img, disp):
-        if len(img.shape) == 2:
-            colors = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+    def to_pc(self, imgL, imgR):
+        """Returns the float32 disparity of the left image, see StereoMatcher"""
+        return self.matcher.compute(imgL, imgR)
+
+    def depthToDisparity(self, depth):
+        """
+        Disparity of a point depth away along the optical axis, solved
+        from Z = Q[2,3] / (Q[3,2]*d + Q[3,3])
+        """
+        Q = self.Q
+        z = np.sign(Q[2,3]/Q[3,2])*depth # sign of Z for positive disparities
+        return (Q[2,3]/z - Q[3,3])/Q[3,2]
+
+    def reproject(self, img, disp, stride=1, min_depth=None, max_depth=None):
+        """
+        Returns the 3D points and their colors for the pixels with a valid
+        disparity. Unlike cv2.reprojectImageTo3D(), only the valid pixels are
+        reprojected and the masks are kept between frames, so there is no
+        full frame of 3D points to throw away.
+
+        img: left image the disparity was computed for, grayscale or color
+        disp: float disparity from to_pc()
+        stride: only use every stride-th row and column, stride=2 is a
+            quarter of the points
+        min_depth/max_depth: only keep points this far away along the optical
+            axis, same units as the baseline
+
+        return: points (N,3) float32, colors (N,3) uint8
+        """
+        d = disp[::stride, ::stride]
+        rows, cols = d.shape
+
+        # invalid matches are min_disp - 1, zero disparity is infinitely far
+        lo = max(self.min_disp - 1, 0)
+        hi = np.inf
+        if max_depth is not None:
+            lo = max(lo, self.depthToDisparity(max_depth))
+        if min_depth is not None:
+            hi = self.depthToDisparity(min_depth)
+
+        buf = self.buffers.get((rows, cols, stride))
+        if buf is None:
+            v, u = np.mgrid[0:rows, 0:cols].astype(np.float32)*stride
+            buf = self.buffers[(rows, cols, stride)] = {
+                "u": u.reshape(-1),
+                "v": v.reshape(-1),
+                "mask": np.empty((rows, cols), dtype=bool),
+                "tmp": np.empty((rows, cols), dtype=bool),
+            }
+
+        mask = np.greater(d, lo, out=buf["mask"])
+        if hi < np.inf:
+            mask &= np.less_equal(d, hi, out=buf["tmp"])
+
+        # gather (u,v,d) of just the valid pixels and reproject them in one
+        # call, np.take() is much faster than boolean or fancy indexing
+        idx = np.flatnonzero(mask)
+        uvd = np.empty((len(idx), 3), dtype=np.float32)
+        uvd[:,0] = np.take(buf["u"], idx)
+        uvd[:,1] = np.take(buf["v"], idx)
+        uvd[:,2] = np.take(d, idx)
+
+        if len(idx) > 0:
+            points = cv2.perspectiveTransform(uvd.reshape(-1,1,3), self.Q.astype(np.float64)).reshape(-1, 3)
         else:
-            colors = img
-
-        # t = self.baseline
-        # f = self.f
-        # Q = np.float32([[1, 0, 0, -0.5*w],
-        #                 [0, 1, 0, -0.5*h],
-        #                 [0, 0, 0,      f],
-        #                 [0, 0,-1/t,    0]])
-        # print(Q)
-
-        points = cv2.reprojectImageTo3D(disp, self.Q)
-#         mask = disp > disp.min()  # find pts with min depth
-#         mask = disp > 1
+            points = uvd
 
-        points = points.reshape(-1, 3)
-        colors = colors.reshape(-1, 3)
-        disp = disp.reshape(-1)
-
-        print(colors.shape, points.shape, disp.shape)
-
-        # filter out NaN and inf (disparity == 0)
-        mask = (
-            (disp > disp.min()) &
-            np.all(~np.isnan(points), axis=1) &
-            np.all(~np.isinf(points), axis=1)
-        )
-
-        out_points = points[mask] # remove pts with no depth
-        out_colors = colors[mask] # remove pts with no depth
-
-        # print(f'>> Generated 3d point cloud, {out_points.shape}')
-        # print(f">> out_points {out_points.max()}, {out_points.min()}")
+        im = img[::stride, ::stride]
+        if im.ndim == 2:
+            colors = np.repeat(np.take(im, idx)[:,None], 3, axis=1) # gray to RGB
+        else:
+            colors = np.take(im.reshape(-1, im.shape[2]), idx, axis=0)
 
-        return out_points, out_colors
+        return points, colors
 
 
 # FIXME: add pathlib here to handle home folder (~)
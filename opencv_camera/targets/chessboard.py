@@ -10,37 +10,69 @@ from opencv_camera.color_space import bgr2gray, gray2bgr
 
 
 class ChessboardFinder:
-    def __init__(self, size, scale):
+    def __init__(self, size, scale, flags=None, detector="classic", pyramid=None, fallback=True):
         """
         size: pattern of chess board, tuple(rows, columns)
         scale: real-world dimension of square side, example, 2 cm (0.02 m)
+        flags: default flags for find()
+        detector: "classic" uses cv2.findChessboardCorners(), "sb" uses
+            cv2.findChessboardCornersSB() which is more accurate and handles
+            blur and noise better
+        pyramid: None searches the full image. A number searches a copy scaled
+            down so its longest side is this many pixels (ex: 800) and then
+            refines the corners on the full image with cv2.cornerSubPix(). This
+            is much faster on large images, especially with no board in them.
+        fallback: with pyramid, search the full image if the board was not
+            found in the scaled down one
         """
+        if detector not in ["classic", "sb"]:
+            raise ValueError(f"ChessboardFinder: invalid detector: {detector}")
+
         self.marker_size = size
         self.marker_scale = scale
         self.type = "Chessboard"
         self.has_ids = False
+        self.flags = flags
+        self.detector = detector
+        self.pyramid = pyramid
+        self.fallback = fallback
 
     def find(self, gray, flags=None):
         """
         Given an image, this will return the corners. Optionally you can enter
-        flags for the cv2.findChessboardCorners() function.
+        flags for the cv2.findChessboardCorners() (or
+        cv2.findChessboardCornersSB()) function.
 
         return:
             success: (True, [corner points],)
             failure: (False, [],)
         """
         if flags is None:
-            flags = 0
-            flags |= cv2.CALIB_CB_ADAPTIVE_THRESH
-            flags |= cv2.CALIB_CB_FAST_CHECK
-            flags |= cv2.CALIB_CB_NORMALIZE_IMAGE
+            flags = self.flags
 
         # ok,gray = cv2.threshold(gray,90,255,cv2.THRESH_BINARY)
 
-        ret, corners = cv2.findChessboardCorners(
-            gray,
-            self.marker_size,
-            flags=flags)
+        rows, cols = gray.shape[:2]
+        scale = 1.0
+        if self.pyramid and max(rows, cols) > self.pyramid:
+            scale = max(rows, cols) / self.pyramid
+            small = cv2.resize(gray, None, fx=1/scale, fy=1/scale, interpolation=cv2.INTER_AREA)
+            ret, corners = self.search(small, flags)
+
+            if ret:
+                # the detector's corners are rough, refine them on the small
+                # image first (cheap), move them to the full image where pixel
+                # centers line up at (x + 0.5)*scale - 0.5, then refine again
+                # within a window big enough to cover the remaining error
+                term = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 30, 0.01)
+                corners = cv2.cornerSubPix(small, corners, (5, 5), (-1, -1), term)
+                corners = ((corners + 0.5)*scale - 0.5).astype(np.float32)
+                win = max(3, int(round(2*scale)))
+                corners = cv2.cornerSubPix(gray, corners, (win, win), (-1, -1), term)
+            elif self.fallback:
+                ret, corners = self.search(gray, flags)
+        else:
+            ret, corners = self.search(gray, flags)
 
         if not ret:
             corners = None
@@ -50,6 +82,25 @@ class ChessboardFinder:
 
         return ret, corners, objp, None
 
+    def search(self, gray, flags=None):
+        """
+        Runs the OpenCV chessboard detector on the image as is
+
+        return: ok, corners
+        """
+        if self.detector == "sb":
+            if flags is None:
+                flags = cv2.CALIB_CB_NORMALIZE_IMAGE
+            return cv2.findChessboardCornersSB(gray, self.marker_size, flags=flags)
+
+        if flags is None:
+            flags = 0
+            flags |= cv2.CALIB_CB_ADAPTIVE_THRESH
+            flags |= cv2.CALIB_CB_FAST_CHECK
+            flags |= cv2.CALIB_CB_NORMALIZE_IMAGE
+
+        return cv2.findChessboardCorners(gray, self.marker_size, flags=flags)
+
     def objectPoints(self):
         """
         Returns a set of the target's ideal 3D feature points.
@@ -0,0 +1,95 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2014 Kevin Walchko
+# see LICENSE for full details
+##############################################
+# -*- coding: utf-8 -*
+import cv2
+import numpy as np
+
+
+class TargetTracker:
+    """
+    Follows a calibration target from frame to frame instead of searching
+    every frame for it. The corners found in the last frame are moved to the
+    new frame with pyramidal Lucas-Kanade optical flow, checked by flowing
+    them back again, and then refined with a small cv2.cornerSubPix() window.
+    The full board.find() only runs when there is nothing to track or the
+    track is lost, so live "board found" feedback keeps up with the camera.
+
+    tracker = TargetTracker(ChessboardFinder((9,6), 0.02))
+    while True:
+        frame = camera.wait_for_frame(1)
+        ok, corners, objp, ids = tracker.find(bgr2gray(frame.image))
+    """
+    def __init__(self, board, win=(21,21), levels=3, max_error=1.0):
+        """
+        board: an object that represents your target, i.e., Chessboard
+        win: optical flow search window size at each pyramid level
+        levels: number of optical flow pyramid levels
+        max_error: max distance (pixels) a corner can be from where it started
+            after flowing it forward and back again, otherwise the track is
+            lost
+        """
+        self.board = board
+        self.win = win
+        self.levels = levels
+        self.max_error = max_error
+        self.objp = board.objectPoints()
+        self.tracked = 0  # number of frames tracked
+        self.searched = 0 # number of frames board.find() was run on
+        self.reset()
+
+    def reset(self):
+        """Forget the last frame, the next find() searches the whole image"""
+        self.prev = None
+        self.corners = None
+
+    def find(self, gray):
+        """
+        Same as board.find(), but tracks the corners from the last frame if it
+        can.
+
+        gray: grayscale image
+        return: ok, corners, objpoints, ids
+        """
+        if self.corners is not None:
+            ok, corners = self.track(gray)
+            if ok:
+                self.prev = gray
+                self.corners = corners
+                self.tracked += 1
+                return True, corners, self.objp, None
+
+        self.searched += 1
+        ok, corners, objp, ids = self.board.find(gray)
+        if not ok:
+            self.reset()
+            return ok, corners, objp, ids
+
+        self.prev = gray
+        self.corners = corners.reshape(-1,1,2).astype(np.float32)
+        return ok, corners, objp, ids
+
+    def track(self, gray):
+        """
+        Moves the last corners into gray
+
+        return: ok, corners
+        """
+        lk = dict(winSize=self.win, maxLevel=self.levels)
+        p1, st, _ = cv2.calcOpticalFlowPyrLK(self.prev, gray, self.corners, None, **lk)
+        if p1 is None or not st.all():
+            return False, None
+
+        # a corner that slid along an edge or jumped to another corner won't
+        # come back to where it started
+        p0, st, _ = cv2.calcOpticalFlowPyrLK(gray, self.prev, p1, None, **lk)
+        if p0 is None or not st.all():
+            return False, None
+        if np.max(np.linalg.norm(p0 - self.corners, axis=2)) > self.max_error:
+            return False, None
+
+        term = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 30, 0.01)
+        p1 = cv2.cornerSubPix(gray, p1, (5,5), (-1,-1), term)
+        return True, p1.reshape(-1,1,2)
@@ -6,7 +6,7 @@
 # -*- coding: utf-8 -*
 from colorama import Fore
 import io
-from threading import Thread #, Lock
+from threading import Thread, Condition
 import time
 # from slurm.rate import Rate
 import numpy as np
@@ -46,9 +46,128 @@ class Rate:
         # as the last time
         self.last_time = time.time()
 
+
+@dataclass
+class Frame:
+    """
+    A captured image and its book keeping
+
+    seq: monotonic sequence number, starts at 0 and increases by 1 each frame
+    timestamp: capture time in seconds, from time.monotonic()
+    image: numpy array
+    """
+    seq: int
+    timestamp: float
+    image: np.ndarray
+
+
+class FrameRing:
+    """
+    Fixed capacity ring of preallocated frame slots with one writer (the
+    capture thread) and any number of readers. Once the slots exist, the
+    writer never allocates and readers never block the writer.
+
+    A reader copies a slot and then checks the slot's sequence number did not
+    change while it was copying (a seqlock). If it did, the writer lapped the
+    reader and the frame is reported missing instead of handed back torn.
+    Missing frames show up as gaps in the sequence numbers.
+
+    ring = FrameRing(4)
+    buf = ring.acquire((480,640,3), np.uint8) # writer: fill buf, then ...
+    seq = ring.publish(time.monotonic())      # ... make it visible
+    frame = ring.get(seq)                     # reader: Frame or None
+    """
+    def __init__(self, capacity=4):
+        """
+        capacity: number of frame slots, must be at least 2 so the writer is
+            never filling the slot readers are copying
+        """
+        if capacity < 2:
+            raise ValueError(f"FrameRing capacity must be >= 2, not {capacity}")
+        self.capacity = capacity
+        self.slots = None
+        self.seqs = [-1]*capacity     # -1: slot empty or being written
+        self.stamps = [0.0]*capacity
+        self.head = -1                # last published sequence number
+
+    def acquire(self, shape, dtype):
+        """
+        Writer only: returns the buffer for the next frame and marks the slot
+        invalid until publish() is called. The slots are only (re)allocated
+        when the frame shape or dtype changes.
+        """
+        dtype = np.dtype(dtype)
+        if self.slots is None or self.slots[0].shape != shape or self.slots[0].dtype != dtype:
+            self.seqs = [-1]*self.capacity
+            self.slots = [np.empty(shape, dtype) for _ in range(self.capacity)]
+
+        i = (self.head + 1) % self.capacity
+        self.seqs[i] = -1
+        return self.slots[i]
+
+    def publish(self, timestamp):
+        """Writer only: makes the acquired slot visible, returns its sequence number"""
+        seq = self.head + 1
+        i = seq % self.capacity
+        self.stamps[i] = timestamp
+        self.seqs[i] = seq
+        self.head = seq
+        return seq
+
+    def get(self, seq):
+        """Returns a copy of frame seq or None if it is no longer (or not yet) in the ring"""
+        if seq < 0 or seq > self.head:
+            return None
+
+        i = seq % self.capacity
+        slots = self.slots
+        if self.seqs[i] != seq:
+            return None
+
+        image = slots[i].copy()
+        timestamp = self.stamps[i]
+
+        # writer touched the slot while we copied it
+        if self.seqs[i] != seq:
+            return None
+
+        return Frame(seq, timestamp, image)
+
+    def latest(self):
+        """Returns a copy of the newest frame or None"""
+        # only fails if the writer lapped us mid copy, so just try again
+        for _ in range(self.capacity):
+            frame = self.get(self.head)
+            if frame is not None:
+                return frame
+        return None
+
+    def since(self, seq):
+        """
+        Returns a list of frames newer than seq, oldest first. Frames that were
+        already overwritten are missing, check for gaps in Frame.seq.
+        """
+        head = self.head
+        start = max(seq + 1, head - self.capacity + 1, 0)
+        frames = []
+        for s in range(start, head + 1):
+            frame = self.get(s)
+            if frame is not None:
+                frames.append(frame)
+        return frames
+
+
 #                                     1   2   3   4
 # ColorSpace = IntFlag("ColorSpace", "bgr rgb hsv gray")
 
+# conversion from the camera's BGR images to the requested colorspace
+_conversions = {
+    ColorSpace.bgr: None,
+    ColorSpace.rgb: cv2.COLOR_BGR2RGB,
+    ColorSpace.hsv: cv2.COLOR_BGR2HSV,
+    ColorSpace.gray: cv2.COLOR_BGR2GRAY,
+}
+
 @dataclass
 class ThreadedCamera:
     """
@@ -61,18 +180,36 @@ class ThreadedCamera:
         optical size: 1/4"
         driver: V4L2 driver
 
+    Captured frames go into a ring of buffer_size preallocated slots. Each
+    frame carries a sequence number and capture timestamp so a consumer can
+    tell a new frame from one it already processed.
+
+    Setting thread_hz to None makes the capture loop event driven: it only
+    blocks on the camera's grab() and wakes anyone in wait_for_frame() as
+    soon as a frame is ready. A number keeps the old behavior of sleeping to
+    hold the loop at that rate.
+
     c = ThreadedCamera()
-    c.open(0, (640,480), 2) # starts internal loop, camera 0, RGB format
-    frame = c.read()        # numpy array
-    c.close()               # stops internal loop and gathers back up the thread
+    c.open(0, (640,480), 2)     # starts internal loop, camera 0, RGB format
+    ok, img = c.read()          # numpy array, copy of newest frame
+    frame = c.read_latest()     # Frame(seq, timestamp, image) or None
+    frames = c.read_since(seq)  # all frames newer than seq still in the ring
+    frame = c.wait_for_frame(1) # blocks until the next frame, None on timeout
+    c.add_callback(fn)          # fn(seq, timestamp, image) on every new frame
+    c.close()                   # stops internal loop and gathers back up the thread
     """
 
     camera = None  # opencv camera object
-    frame: np.ndarray = None   # current frame
     run: bool = False    # thread loop run parameter
-    thread_hz: float = 30 # thread loop rate
+    thread_hz: float = 30 # thread loop rate, None to run at the camera rate
     fmt: int = 0        # colorspact format
+    buffer_size: int = 4 # number of frames kept in the ring
+    driver_time: bool = False # time stamp frames with the driver's clock, see grab()
     ps = None      # thread process
+    ring = None    # FrameRing of captured frames
+    cond = None    # Condition notified on every new frame
+    raw = None     # capture buffer reused by the camera
+    callbacks = () # called by the capture thread on every new frame
     # lock = attr.ib(default=Lock())
 
 
@@ -81,8 +218,13 @@ class ThreadedCamera:
 
     def close(self):
         self.run = False
-        time.sleep(0.25)
-        self.camera.release()
+        if self.cond is not None:
+            with self.cond:
+                self.cond.notify_all()
+        if self.ps is not None:
+            self.ps.join(1.0)
+        if self.camera is not None:
+            self.camera.release()
 
     def __colorspace(self):
         s = "unknown"
@@ -110,13 +252,15 @@ class ThreadedCamera:
         rows = self.camera.get(4) #cv2.CAP_PROP_FRAME_HEIGHT
         return (rows, cols,)
 
-    def open(self, path=0, resolution=None, fmt=ColorSpace.bgr):
+    def open(self, path=0, resolution=None, fmt=ColorSpace.bgr, start=True):
         """
         Opens the camera object and starts the internal loop in a thread
 
         path: which camera to open 0,1,2, ..., default: 0
         resolution: what supported resolution from the camera do you want (height,width)
         fmt: image format, 1(BGR), 2(RGB), 4(HSV), 8(grayscale), default is BGR
+        start: start the capture thread, set to False when something else
+            (like CameraGroup) calls grab() and retrieve()
         """
 
         if fmt not in list(ColorSpace):
@@ -124,12 +268,18 @@ class ThreadedCamera:
             fmt = 1
         self.fmt = fmt
 
+        self.ring = FrameRing(self.buffer_size)
+        self.cond = Condition()
         self.run = True
         self.camera = cv2.VideoCapture(path)
 
         if resolution:
             self.set_resolution(resolution)
 
+        # don't let the driver queue up old frames, grab() should return the
+        # newest one
+        self.camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
         width = self.camera.get(cv2.CAP_PROP_FRAME_WIDTH)
         height = self.camera.get(cv2.CAP_PROP_FRAME_HEIGHT)
         fps = int(self.camera.get(5))
@@ -140,39 +290,149 @@ class ThreadedCamera:
         print(f"Colorspace: {self.__colorspace()}")
         print("")
 
-        self.ps = Thread(target=self.thread_func, args=(path, resolution))
-        self.ps.daemon = True
-        self.ps.start()
+        if start:
+            self.ps = Thread(target=self.thread_func, args=(path, resolution))
+            self.ps.daemon = True
+            self.ps.start()
         return self
 
     def read(self):
-        """Returns image frame or None if no frame captured"""
-        if self.frame is None:
+        """Returns (True, copy of newest image) or (False, None) if no frame captured"""
+        frame = self.read_latest()
+        if frame is None:
+            return False, None
+
+        return True, frame.image
+
+    def read_latest(self):
+        """Returns the newest Frame or None if no frame captured"""
+        if self.ring is None:
+            return None
+        return self.ring.latest()
+
+    def read_since(self, seq):
+        """
+        Returns a list of the Frames captured after sequence number seq, oldest
+        first. Use seq=-1 for everything still in the ring. If the consumer
+        fell more than buffer_size frames behind, the gap in Frame.seq shows
+        how many were dropped.
+        """
+        if self.ring is None:
+            return []
+        return self.ring.since(seq)
+
+    def wait_for_frame(self, timeout=None, seq=None):
+        """
+        Blocks until a frame newer than seq is captured and returns the newest
+        Frame, or None on timeout or if the camera is closed.
+
+        timeout: seconds to wait, None waits forever
+        seq: sequence number already seen, default is the newest frame at the
+            time of the call, so this waits for the next one
+        """
+        if self.ring is None:
+            return None
+
+        with self.cond:
+            if seq is None:
+                seq = self.ring.head
+            ok = self.cond.wait_for(lambda: self.ring.head > seq or not self.run, timeout)
+
+        if not ok or not self.run:
+            return None
+
+        # copy outside of the lock so the capture thread never waits on us
+        return self.ring.latest()
+
+    def _store(self, img, timestamp):
+        """Internal function, converts img into the next ring slot and publishes it"""
+        if self.fmt not in _conversions:
+            print(f"{Fore.RED}*** Threaded Camera: Unknown color format: {self.fmt}, reset to BGR ***{Fore.RESET}")
+            self.fmt = ColorSpace.bgr
+
+        code = _conversions[self.fmt]
+        shape = img.shape[:2] if self.fmt == ColorSpace.gray else img.shape
+        slot = self.ring.acquire(shape, img.dtype)
+
+        if code is None:
+            np.copyto(slot, img)
+        else:
+            cv2.cvtColor(img, code, dst=slot)
+
+        with self.cond:
+            seq = self.ring.publish(timestamp)
+            self.cond.notify_all()
+
+        for fn in self.callbacks:
+            try:
+                fn(seq, timestamp, slot)
+            except Exception as e:
+                print(f"{Fore.RED}*** Threaded Camera: callback {fn}: {e} ***{Fore.RESET}")
+        return seq
+
+    def add_callback(self, fn):
+        """
+        Calls fn(seq, timestamp, image) from the capture thread every time a
+        frame is captured. image is the frame's ring slot, not a copy, and is
+        only good until fn returns, so copy what you need. fn must be quick,
+        the next frame isn't captured until it returns.
+        """
+        # a new tuple so the capture thread never sees a half changed one
+        self.callbacks = self.callbacks + (fn,)
+
+    def remove_callback(self, fn):
+        self.callbacks = tuple(f for f in self.callbacks if f != fn)
+
+    def grab(self):
+        """
+        Grabs the next frame from the camera without decoding it. This blocks
+        until the driver has a frame.
+
+        The timestamp is time.monotonic() when grab() returned, which is only
+        close to the capture time if the driver isn't queueing old frames
+        (open() asks for a driver buffer of one frame, not every backend
+        honors it). With driver_time, the driver's own buffer timestamp
+        (CAP_PROP_POS_MSEC, V4L2 uses the monotonic clock) is used when it
+        has one. For video files that is the position in the file.
+
+        return: (True, capture timestamp) or (False, None)
+        """
+        if not self.camera.grab():
             return False, None
+        if self.driver_time:
+            ms = self.camera.get(cv2.CAP_PROP_POS_MSEC)
+            if ms > 0:
+                return True, ms/1000
+        return True, time.monotonic()
+
+    def retrieve(self, timestamp):
+        """
+        Decodes the grabbed frame into the ring.
+
+        timestamp: capture time returned by grab()
+        return: sequence number of the new frame or None on failure
+        """
+        ok, img = self.camera.retrieve(self.raw)
+        if not ok:
+            return None
 
-        return True, self.frame
+        self.raw = img
+        return self._store(img, timestamp)
 
     def thread_func(self, path, resolution):
         """Internal function, do not call"""
 
-        rate = Rate(self.thread_hz)
+        rate = Rate(self.thread_hz) if self.thread_hz else None
 
         while self.run:
-            rate.sleep()
-            ok, img = self.camera.read()
+            if rate is not None:
+                rate.sleep()
 
+            # grab() blocks until the driver has a frame, time stamp it as
+            # close to capture as we can, then decode
+            ok, timestamp = self.grab()
             if not ok:
+                time.sleep(0.001) # don't spin on a dead camera
                 continue
 
-            if self.fmt == ColorSpace.bgr:
-                self.frame = img
-            elif self.fmt == ColorSpace.hsv:
-                self.frame = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-            elif self.fmt == ColorSpace.rgb:
-                self.frame = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            elif self.fmt == ColorSpace.gray:
-                self.frame = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            else:
-                print(f"{Fore.RED}*** Threaded Camera: Unknown color format: {self.fmt}, reset to BGR ***{Fore.RESET}")
-                self.fmt = ColorSpace.bgr
-                self.frame = img
+            self.retrieve(timestamp)
@@ -0,0 +1,302 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2014 Kevin Walchko
+# see LICENSE for full details
+##############################################
+# -*- coding: utf-8 -*
+import socket
+import struct
+import time
+from threading import Lock
+import numpy as np
+
+
+# every datagram of a frame starts with:
+#   frame id, frame size, chunk index, chunk count, byte offset in the frame
+HEADER = struct.Struct("<IIHHI")
+
+# payload per datagram, small enough that a datagram fits in one ethernet
+# packet (1500 MTU) so losing a packet only loses one chunk
+CHUNK_SIZE = 1400
+
+MAX_CHUNKS = 2**16 - 1
+
+
+def sendFrame(sock, address, frame_id, data, chunk_size=CHUNK_SIZE):
+    """
+    Sends a frame (ex: jpeg buffer) as numbered chunks, so frames bigger than
+    one UDP datagram (65507 bytes) can be sent.
+
+    sock: UDP socket
+    address: (host, port) to send to
+    frame_id: frame number, increase it for every frame
+    data: bytes, bytearray or numpy array of the frame
+    chunk_size: payload bytes per datagram
+    """
+    view = memoryview(data).cast("B")
+    size = len(view)
+    count = max(1, -(-size // chunk_size))
+    if count > MAX_CHUNKS:
+        raise ValueError(f"sendFrame: frame too big, {size} bytes")
+
+    frame_id &= 0xFFFFFFFF
+    scatter = hasattr(sock, "sendmsg") # not on windows
+    for i in range(count):
+        offset = i*chunk_size
+        header = HEADER.pack(frame_id, size, i, count, offset)
+        chunk = view[offset:offset + chunk_size]
+        if scatter:
+            # scatter/gather, the payload is never copied
+            sock.sendmsg([header, chunk], [], 0, address)
+        else:
+            sock.sendto(header + bytes(chunk), address)
+
+
+class FrameAssembler:
+    """
+    Puts the chunks sent by sendFrame() back together into preallocated
+    buffers. Chunks can arrive in any order. A frame is dropped if a newer
+    frame starts before it is complete, or if it isn't complete within
+    timeout seconds of its first chunk.
+
+    Two buffers are used, so a returned frame stays valid until the next one
+    is complete.
+
+    Chunks of frames older than the last complete one are ignored, unless
+    the id is more than RESTART frames old or no frame was completed for
+    timeout seconds, then the sender is assumed to have restarted its ids.
+
+    fa = FrameAssembler()
+    while True:
+        frame = fa.recv(sock)  # numpy uint8 array or None
+        if frame is not None:
+            img = cv2.imdecode(frame, 1)
+    """
+    RESTART = 1024 # frames behind the last one that mean the sender restarted
+
+    def __init__(self, max_size=2**23, timeout=0.5):
+        """
+        max_size: biggest frame in bytes, bigger frames are dropped
+        timeout: seconds to wait for the rest of a frame
+        """
+        self.buffers = [bytearray(max_size), bytearray(max_size)]
+        self.packet = bytearray(2**16)
+        self.timeout = timeout
+        self.dropped = 0    # incomplete frames thrown away
+        self.received = 0   # complete frames
+        self.reset()
+
+    def reset(self):
+        """Forget the frame being put together"""
+        self.frame_id = None
+        self.size = 0
+        self.count = 0
+        self.chunk = None  # payload bytes of every chunk but the last
+        self.chunks = None
+        self.missing = 0
+        self.start = 0
+        self.last = None   # id of the last complete frame
+        self.done = 0      # time the last frame was completed
+        self.current = 0   # buffer the frame is put together in
+
+    def expired(self):
+        """True if the frame being put together ran out of time"""
+        return self.chunks is not None and time.monotonic() - self.start > self.timeout
+
+    def drop(self):
+        if self.chunks is not None and self.missing > 0:
+            self.dropped += 1
+        self.frame_id = None
+        self.chunks = None
+
+    def add(self, packet):
+        """
+        Adds one datagram, returns the frame (numpy uint8 array) if it is now
+        complete, otherwise None
+        """
+        n = len(packet)
+        if n < HEADER.size:
+            return None
+
+        frame_id, size, index, count, offset = HEADER.unpack_from(packet)
+        payload = n - HEADER.size
+        if index >= count or offset + payload > size:
+            return None # garbage
+
+        # every chunk but the last one is full, so the chunk size and the
+        # index have to agree with the offset, or the frame ends up with holes
+        if index < count - 1:
+            chunk = payload
+            if chunk == 0 or offset != index*chunk or -(-size // chunk) != count:
+                return None
+        else:
+            if offset + payload != size:
+                return None
+            chunk = offset // index if index else None
+            if index and (offset % index or payload > chunk or -(-size // chunk) != count):
+                return None
+
+        if self.expired():
+            self.drop()
+
+        if frame_id != self.frame_id:
+            # late chunk of an old frame, the ids wrap around at 2**32
+            if self.last is not None:
+                behind = (self.last - frame_id) & 0xFFFFFFFF
+                if behind < 2**31:
+                    if behind <= self.RESTART and time.monotonic() - self.done <= self.timeout:
+                        return None
+                    self.last = None # sender restarted, start over from this id
+            if self.frame_id is not None and ((self.frame_id - frame_id) & 0xFFFFFFFF) < 2**31:
+                return None
+
+            # a newer frame started, the current one is never finishing
+            self.drop()
+            if size > len(self.buffers[0]):
+                self.dropped += 1
+                self.last = frame_id
+                return None
+
+            self.frame_id = frame_id
+            self.size = size
+            self.count = count
+            self.chunk = chunk
+            self.chunks = np.zeros(count, dtype=bool)
+            self.missing = count
+            self.start = time.monotonic()
+
+        elif size != self.size or count != self.count:
+            return None # not a chunk of the frame being put together
+        elif chunk is not None:
+            if self.chunk is None:
+                self.chunk = chunk
+            elif chunk != self.chunk:
+                return None
+
+        if self.chunks[index]:
+            return None # duplicate
+        self.chunks[index] = True
+        self.missing -= 1
+
+        buf = self.buffers[self.current]
+        buf[offset:offset + payload] = memoryview(packet)[HEADER.size:]
+
+        if self.missing > 0:
+            return None
+
+        # done, the next frame goes in the other buffer
+        frame = np.frombuffer(buf, dtype=np.uint8, count=self.size)
+        self.current ^= 1
+        self.last = self.frame_id
+        self.done = time.monotonic()
+        self.frame_id = None
+        self.chunks = None
+        self.received += 1
+        return frame
+
+    def recv(self, sock, timeout=None):
+        """
+        Reads datagrams from sock until a frame is complete
+
+        timeout: seconds to wait for a frame, default is the socket timeout
+        return: frame (numpy uint8 array) or None on timeout
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        view = memoryview(self.packet)
+
+        while True:
+            if end is not None:
+                left = end - time.monotonic()
+                if left <= 0:
+                    return None
+                sock.settimeout(left)
+            try:
+                n = sock.recv_into(self.packet)
+            except (socket.timeout, BlockingIOError):
+                if self.expired():
+                    self.drop()
+                return None
+
+            frame = self.add(view[:n])
+            if frame is not None:
+                return frame
+
+
+# control messages from a client to the server: a uint32 command and, for
+# SUBSCRIBE, the max frame rate (0 is as fast as the camera)
+STOP, REQUEST, SUBSCRIBE, UNSUBSCRIBE = 0, 1, 2, 3
+COMMAND = struct.Struct("<L")
+CONTROL = struct.Struct("<Lf")
+
+
+def packControl(cmd, rate=0):
+    """Returns a control message for the server"""
+    if cmd == SUBSCRIBE:
+        return CONTROL.pack(cmd, rate or 0)
+    return COMMAND.pack(cmd)
+
+
+def unpackControl(data):
+    """Returns (command, rate) of a control message, (None, 0) if invalid"""
+    if len(data) >= CONTROL.size:
+        return CONTROL.unpack_from(data)
+    if len(data) >= COMMAND.size:
+        return COMMAND.unpack_from(data)[0], 0
+    return None, 0
+
+
+class Subscribers:
+    """
+    Clients the server pushes frames to. A client subscribes once and then
+    sends SUBSCRIBE again as a keepalive (see KEEPALIVE), if the server
+    doesn't hear from it within expire seconds it is dropped. Each client
+    can ask for a max frame rate so a slow link isn't flooded.
+
+    subs = Subscribers()
+    subs.subscribe(address, rate=10)  # on every SUBSCRIBE message
+    for address in subs.due():        # on every new frame
+        sendFrame(sock, address, frame_id, jpeg)
+    """
+    KEEPALIVE = 1.0 # seconds between a client's SUBSCRIBE messages
+
+    def __init__(self, expire=3.0):
+        self.expire = expire
+        self.clients = {} # address: [last heard, min seconds between frames, last sent]
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.clients)
+
+    def subscribe(self, address, rate=0):
+        """Adds a client or refreshes its keepalive"""
+        period = 1.0/rate if rate and rate > 0 else 0.0
+        now = time.monotonic()
+        with self.lock:
+            c = self.clients.get(address)
+            if c is None:
+                self.clients[address] = [now, period, 0.0]
+            else:
+                c[0], c[1] = now, period
+
+    def unsubscribe(self, address):
+        with self.lock:
+            self.clients.pop(address, None)
+
+    def due(self):
+        """
+        Returns the clients that should get the current frame, drops the ones
+        that stopped sending keepalives
+        """
+        now = time.monotonic()
+        out = []
+        with self.lock:
+            for address, c in list(self.clients.items()):
+                heard, period, sent = c
+                if now - heard > self.expire:
+                    del self.clients[address]
+                # a little slack so camera timing jitter doesn't skip a
+                # frame when the rate divides the camera frame rate
+                elif now - sent >= 0.9*period:
+                    c[2] = now
+                    out.append(address)
+        return out
@@ -5,6 +5,9 @@ import numpy as np
 from pathlib import Path
 import pytest
 import os
+import time
+from collections import deque
+from threading import Condition
 
 
 def rm(fname):
@@ -159,3 +162,784 @@ def test_compressor():
 def test_fail_compressor():
     with pytest.raises(ValueError):
         compressor("jpeg", False)
+
+def test_frame_ring():
+    ring = FrameRing(3)
+    assert ring.latest() is None
+
+    for i in range(5):
+        buf = ring.acquire((4,5,3), np.uint8)
+        buf[:] = i
+        seq = ring.publish(float(i))
+        assert seq == i
+
+    frame = ring.latest()
+    assert frame.seq == 4
+    assert frame.timestamp == 4.0
+    assert np.all(frame.image == 4)
+
+    # the copy is not touched by the writer
+    ring.acquire((4,5,3), np.uint8)[:] = 99
+    assert np.all(frame.image == 4)
+
+    # 5 was acquired but not published, frames 0-2 were overwritten
+    assert [f.seq for f in ring.since(-1)] == [3, 4]
+    assert ring.since(4) == []
+    assert ring.get(0) is None
+    assert ring.get(5) is None
+
+    with pytest.raises(ValueError):
+        FrameRing(1)
+
+def make_video(fname, num=6):
+    mpeg = SaveVideo()
+    mpeg.open(fname, 64, 48, fps=30)
+    for i in range(num):
+        mpeg.write(np.full((48,64,3), 40*i, dtype=np.uint8))
+    mpeg.close()
+
+def test_threaded_camera_wait(tmp_path):
+    fname = str(tmp_path / "frames.avi")
+    make_video(fname)
+
+    cam = ThreadedCamera(thread_hz=None, buffer_size=8)
+    cam.open(fname, fmt=ColorSpace.gray)
+
+    frame = cam.wait_for_frame(2, seq=-1)
+    assert frame is not None
+    assert frame.image.shape == (48,64)
+
+    # video file is done, no more frames will show up
+    time.sleep(0.2)
+    assert cam.wait_for_frame(0.1) is None
+
+    seqs = [f.seq for f in cam.read_since(-1)]
+    assert seqs == list(range(6))
+    cam.close()
+
+class FakeCapture:
+    """cv2.VideoCapture of a 30 fps camera that is lag frames behind"""
+    def __init__(self, lag, group):
+        self.n = 0
+        self.lag = lag
+        self.group = group
+
+    def grab(self):
+        self.n += 1
+        if self.n > 20:
+            self.group.run = False
+        return True
+
+    def retrieve(self, image=None):
+        return True, np.full((4,4), self.n, dtype=np.uint8)
+
+    def get(self, prop):
+        return 1000 + (self.n - self.lag)*1000/30
+
+    def release(self):
+        pass
+
+def fake_group(lags, **kw):
+    """CameraGroup of FakeCaptures, call thread_func() to run it to the end"""
+    group = CameraGroup(**kw)
+    group.cameras = []
+    for lag in lags:
+        cam = ThreadedCamera(fmt=ColorSpace.bgr, driver_time=True)
+        cam.camera = FakeCapture(lag, group)
+        cam.ring = FrameRing(4)
+        cam.cond = Condition()
+        group.cameras.append(cam)
+    group.drops = [0]*len(lags)
+    group.sets = deque(maxlen=group.buffer_size)
+    group.head = -1
+    group.cond = Condition()
+    group.run = True
+    return group
+
+def test_camera_group():
+    group = fake_group([0, 0], skew=0.002)
+    group.thread_func()
+    fs = group.read_latest()
+    assert fs is not None
+    assert len(fs.images) == 2
+    assert fs.skew <= 0.002
+    assert np.array_equal(fs.images[0], fs.images[1])
+    assert group.drops == [0, 0]
+
+    # nothing can be within a negative skew, so every set is dropped
+    group = fake_group([0, 0], skew=-1.0)
+    group.thread_func()
+    assert group.head == -1 and group.read_latest() is None
+    assert group.drops[0] > 0 and group.drops[1] > 0
+
+def test_camera_group_catch_up():
+    # camera 1 is a frame behind, every set would be dropped unless it
+    # grabs again to catch up
+    group = fake_group([0, 1], skew=0.002)
+    group.thread_func()
+    assert group.head >= 0
+    fs = group.read_latest()
+    assert fs.skew <= 0.002
+    assert group.drops == [0, 0]
+
+    # without catching up nothing lines up
+    group.retries = 0
+    group.run = True
+    for cam in group.cameras:
+        cam.camera.n = 0
+    head = group.head
+    group.thread_func()
+    assert group.head == head
+
+K = np.array([
+    [532.8, 0, 342.5],
+    [0, 532.9, 233.9],
+    [0, 0, 1]
+])
+D = np.array([[-0.28, 0.03, 0.001, 0.0, 0.1]])
+
+def test_undistort_fixed_point():
+    p = Path(__file__).parent.absolute() / "cal_images/left01.jpg"
+    im = cv2.imread( str(p) )
+    h,w = im.shape[:2]
+
+    fl = UnDistort(K, D, h, w)
+    fx = UnDistort(K, D, h, w, fixed_point=True)
+    assert fx.mapx.dtype == np.int16 and fx.mapx.shape == (h,w,2)
+    assert fx.mapy.dtype == np.uint16 and fx.mapy.shape == (h,w)
+    assert fx.mapx.nbytes + fx.mapy.nbytes < fl.mapx.nbytes + fl.mapy.nbytes
+
+    a = fl.undistort(im).astype(int)
+    b = fx.undistort(im).astype(int)
+    assert np.mean(np.abs(a - b)) < 1
+
+def test_map_cache(tmp_path):
+    h,w = 480,640
+    cam = Camera(K, D, h, w)
+    cam.to_yaml(tmp_path / "camera.yml")
+
+    cache = MapCache(tmp_path / "maps", source=tmp_path / "camera.yml")
+    un = cam.getUndistortion(fixed_point=True, cache=cache)
+    assert len(list(cache.path.glob("*.npy"))) == 2
+    assert isinstance(un.mapx, np.memmap)
+
+    # second time comes off of disk
+    un2 = cam.getUndistortion(fixed_point=True, cache=cache)
+    assert np.array_equal(un.mapx, un2.mapx)
+    assert np.array_equal(un.mapy, un2.mapy)
+
+    # different settings, different maps
+    cam.getUndistortion(cache=cache)
+    assert len(list(cache.path.glob("*.npy"))) == 4
+
+    # changing the calibration file throws out the old maps
+    Camera(K*1.01, D, h, w).to_yaml(tmp_path / "camera.yml")
+    os.utime(tmp_path / "camera.yml", ns=(0, 0))
+    assert cache.get(cache.key(K, D, None, (w,h), 0, cv2.CV_32FC1)) is None
+    assert len(list(cache.path.glob("*.npy"))) == 0
+
+    # so does removing it, the maps are built again
+    cam.getUndistortion(cache=cache)
+    assert len(list(cache.path.glob("*.npy"))) == 2
+    os.remove(tmp_path / "camera.yml")
+    un = cam.getUndistortion(cache=cache)
+    assert isinstance(un.mapx, np.memmap)
+    assert len(list(cache.path.glob("*.npy"))) == 2
+
+def test_undistort_alpha_cache():
+    h,w = 480,640
+    im = np.random.randint(0, 255, (h,w), dtype=np.uint8)
+
+    # room for 2 sets of float maps
+    un = UnDistort(K, D, h, w, cache_bytes=2*8*h*w)
+    mapx = un.mapx
+
+    a = un.undistort(im, alpha=0.5)
+    assert np.array_equal(a, un.undistort(im, alpha=0.5))
+    un.undistort(im, alpha=1)
+    un.undistort(im, alpha=0.25) # pushes out 0.5
+    info = un.cacheInfo()
+    assert info.hits == 1
+    assert info.misses == 3
+    assert info.evictions == 1
+    assert info.size == 2
+    assert info.nbytes == 2*8*h*w
+
+    # default maps are never replaced
+    assert un.mapx is mapx
+    assert np.array_equal(un.undistort(im), un.undistort(im, alpha=0))
+    assert un.cacheInfo().misses == 3
+
+def test_undistort_roi():
+    p = Path(__file__).parent.absolute() / "cal_images/left01.jpg"
+    im = cv2.imread( str(p) )
+    h,w = im.shape[:2]
+
+    for fixed in [False, True]:
+        un = UnDistort(K, D, h, w, fixed_point=fixed)
+        for alpha in [None, 1]:
+            full = un.undistort(im, alpha=alpha)
+            for x,y,ww,hh in [(0,0,w,h), (200,150,64,48), (0,0,10,10), (w-30,h-20,30,20)]:
+                roi = un.undistortROI(im, (x,y,ww,hh), alpha=alpha)
+                assert np.array_equal(roi, full[y:y+hh,x:x+ww])
+
+def test_reprojection_errors():
+    imgs = get()
+    board = ChessboardFinder((9,6), 1)
+    data = CameraCalibration().calibrate(imgs, board)
+
+    rms, rms_view, errors, counts = computeReprojectionErrors(
+        data["imgpoints"], data["objpoints"],
+        data["rvecs"], data["tvecs"],
+        data["K"], data["d"])
+
+    assert abs(rms - data["rms"]) < 1e-6
+    assert np.allclose(rms_view, data["perViewErr"].ravel(), atol=1e-4)
+    assert errors.shape == (len(imgs)*9*6, 2)
+    assert np.all(counts == 9*6)
+
+    for i,(o,p) in enumerate(zip(data["objpoints"], data["imgpoints"])):
+        pp, _ = cv2.projectPoints(o, data["rvecs"][i], data["tvecs"][i], data["K"], data["d"])
+        err = pp.reshape(-1,2) - p
+        assert np.allclose(err, errors[i*54:(i+1)*54], atol=1e-3)
+
+    # views with different numbers of points, and one without any
+    n = [54, 20, 0, 54]
+    obj = [o[:k] for o,k in zip(data["objpoints"], n)]
+    img = [p[:k] for p,k in zip(data["imgpoints"], n)]
+    rms, rms_view, errors, counts = computeReprojectionErrors(
+        img, obj, data["rvecs"][:4], data["tvecs"][:4], data["K"], data["d"])
+    assert list(counts) == n
+    assert len(errors) == sum(n)
+    assert np.isnan(rms_view[2]) and not np.isnan(rms_view[[0,1,3]]).any()
+    for e, r in zip(np.split(errors, np.cumsum(counts)[:-1]), rms_view):
+        if len(e):
+            assert np.isclose(np.sqrt(np.mean(np.sum(e**2, axis=1))), r)
+
+def test_find_points_parallel():
+    imgs = get()
+    board = ChessboardFinder((9,6), 1)
+    cal = CameraCalibration()
+
+    obj, img, _ = cal.findPoints(imgs, board)
+    pobj, pimg, _ = cal.findPoints(iter(imgs), board, workers=3)
+
+    assert len(obj) == len(pobj) == len(imgs)
+    for a,b in zip(img, pimg):
+        assert np.array_equal(a, b)
+
+def test_calibrate_lazy_images():
+    board = ChessboardFinder((9,6), 1)
+    cal = CameraCalibration()
+    p = Path(__file__).parent.absolute() / "cal_images"
+
+    data = cal.calibrate(get(), board)
+    for src in [str(p), str(p / "left*.jpg"), (cv2.imread(str(f)) for f in p.glob("*.jpg"))]:
+        d = cal.calibrate(src, board)
+        assert d["height"] == data["height"] and d["width"] == data["width"]
+        assert len(d["imgpoints"]) == len(data["imgpoints"])
+        assert abs(d["rms"] - data["rms"]) < 1e-3
+
+def test_detection_cache(tmp_path):
+    board = ChessboardFinder((9,6), 1)
+    cal = CameraCalibration()
+    p = str(Path(__file__).parent.absolute() / "cal_images")
+    fname = tmp_path / "detections.npz"
+
+    cache = DetectionCache(fname)
+    data = cal.calibrate(p, board, cache=cache)
+    assert fname.exists()
+    assert len(cache) == 13
+
+    # a new cache loads from disk and never searches an image
+    cache = DetectionCache(fname)
+    calls = []
+    find = board.find
+    board.find = lambda *a, **k: calls.append(1) or find(*a, **k)
+    d = cal.calibrate(p, board, flags=cv2.CALIB_FIX_K3, cache=cache)
+    assert calls == []
+    assert len(d["imgpoints"]) == len(data["imgpoints"])
+    for a,b in zip(d["imgpoints"], data["imgpoints"]):
+        assert np.array_equal(a, b)
+
+    # different board settings miss the cache
+    assert cache.get(cache.key(ChessboardFinder((9,6), 2), p + "/left01.jpg")) is None
+    im = p + "/left01.jpg"
+    assert cache.key(ChessboardFinder([9,6], 1), im) != cache.key(ChessboardFinder([7,5], 1), im)
+    assert cache.key(ChessboardFinder([9,6], 1), im) == cache.key(ChessboardFinder((9,6), 1), im)
+    assert cache.key(ChessboardFinder(np.array([9,6]), 1), im) == cache.key(ChessboardFinder((9,6), 1), im)
+
+    class Board:
+        has_ids = False
+        def __init__(self):
+            self.dictionary = object()
+    with pytest.raises(TypeError):
+        cache.key(Board(), im)
+
+def test_detection_cache_partial(tmp_path):
+    imgs = get()
+    board = ChessboardFinder((9,6), 1)
+    cal = CameraCalibration()
+    obj, img, _ = cal.findPoints(imgs, board)
+
+    # only every other image is cached, the rest are searched
+    cache = DetectionCache(tmp_path / "detections.npz")
+    cal.findPoints(imgs[::2], board, cache=cache)
+    calls = []
+    find = board.find
+    board.find = lambda *a, **k: calls.append(1) or find(*a, **k)
+    _, cimg, _ = cal.findPoints(imgs, board, cache=cache)
+    assert len(calls) == len(imgs[1::2])
+    board.find = find
+
+    cache = DetectionCache(tmp_path / "detections2.npz")
+    cal.findPoints(imgs[1::2], board, cache=cache)
+    _, pimg, _ = cal.findPoints(iter(imgs), board, workers=3, cache=cache)
+    assert len(cache) == len(imgs)
+
+    for found in [cimg, pimg]:
+        assert len(found) == len(img)
+        for a,b in zip(img, found):
+            assert np.array_equal(a, b)
+
+def test_chessboard_pyramid():
+    board = ChessboardFinder((9,6), 1)
+    coarse = ChessboardFinder((9,6), 1, pyramid=400, fallback=False)
+    sb = ChessboardFinder((9,6), 1, detector="sb", pyramid=400)
+    term = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 30, 0.001)
+
+    for im in get():
+        gray = bgr2gray(im)
+        ok, ref, _, _ = board.find(gray)
+        ref = cv2.cornerSubPix(gray, ref, (5,5), (-1,-1), term)
+
+        ok, corners, objp, _ = coarse.find(gray)
+        assert ok
+        err = corners.reshape(-1,2) - ref.reshape(-1,2)
+        assert np.max(np.linalg.norm(err, axis=1)) < 0.5
+        assert np.array_equal(objp, board.objectPoints())
+
+        ok, corners, _, _ = sb.find(gray)
+        assert ok and corners.size == ref.size
+
+    with pytest.raises(ValueError):
+        ChessboardFinder((9,6), 1, detector="fast")
+
+def test_target_tracker():
+    p = Path(__file__).parent.absolute() / "cal_images/left01.jpg"
+    gray = cv2.imread(str(p), cv2.IMREAD_GRAYSCALE)
+    board = ChessboardFinder((9,6), 1)
+    tracker = TargetTracker(board)
+    term = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 30, 0.01)
+
+    for dx in range(0, 20, 2):
+        M = np.float32([[1,0,dx],[0,1,dx/2]])
+        im = cv2.warpAffine(gray, M, gray.shape[::-1])
+        ok, corners, objp, _ = tracker.find(im)
+        assert ok
+        assert np.array_equal(objp, board.objectPoints())
+
+        ok, ref, _, _ = board.find(im)
+        ref = cv2.cornerSubPix(im, ref, (5,5), (-1,-1), term)
+        err = corners.reshape(-1,2) - ref.reshape(-1,2)
+        assert np.max(np.linalg.norm(err, axis=1)) < 0.5
+
+    assert tracker.searched == 1
+    assert tracker.tracked == 9
+
+    # lost the board
+    ok, _, _, _ = tracker.find(np.zeros_like(gray))
+    assert not ok
+    assert tracker.searched == 2
+    assert tracker.corners is None
+
+def test_select_views():
+    board = ChessboardFinder((9,6), 1)
+    cal = CameraCalibration()
+    p = str(Path(__file__).parent.absolute() / "cal_images")
+
+    full = cal.calibrate(p, board)
+    assert full["index"] == list(range(13))
+
+    data = cal.calibrate(p, board, max_views=8)
+    assert len(data["imgpoints"]) == 8
+    assert len(set(data["index"])) == 8
+    assert abs(data["rms"] - full["rms"]) < 0.05
+    assert np.allclose(data["K"], full["K"], atol=5)
+
+    # coverage alone: a view covering new cells beats a duplicate
+    pts = [np.array([[10,10],[20,20]]), np.array([[10,10],[20,20]]), np.array([[600,400],[620,440]])]
+    assert selectViews(pts, (480,640), 2) == [0, 2]
+
+def test_calibrate_update():
+    board = ChessboardFinder((9,6), 1)
+    cal = CameraCalibration()
+    p = sorted(str(f) for f in (Path(__file__).parent.absolute() / "cal_images").glob("*.jpg"))
+
+    full = cal.calibrate(p, board)
+    data = cal.calibrate(p[:9], board)
+
+    calls = []
+    find = board.find
+    board.find = lambda *a, **k: calls.append(1) or find(*a, **k)
+    d = cal.update(data, p[9:], board)
+    board.find = find
+
+    assert len(calls) == 4 # only the new images are searched
+    assert d["index"] == full["index"]
+    assert len(d["imgpoints"]) == 13
+    assert abs(d["rms"] - full["rms"]) < 1e-3
+    assert np.allclose(d["K"], full["K"], atol=1)
+
+    with pytest.raises(ValueError):
+        cal.update(data, [np.zeros((240,320), dtype=np.uint8)], board)
+
+def test_stereo_calibrate(tmp_path):
+    board = ChessboardFinder((9,6), 1)
+    left = [bgr2gray(im) for im in get()]
+
+    # fake right camera: shifted 20 px and the target missing in one image
+    M = np.float32([[1,0,-20],[0,1,0]])
+    right = [cv2.warpAffine(im, M, im.shape[::-1]) for im in left]
+    right[3] = np.zeros_like(right[3])
+
+    sc = StereoCalibration()
+    cache = DetectionCache(tmp_path / "detections.npz")
+    ret, model = sc.calibrate(left, right, board, cache=cache)
+    assert len(cache) == 26
+    assert model["index"] == [i for i in range(len(left)) if i != 3]
+    assert len(model["imgpointsL"]) == len(model["imgpointsR"]) == len(model["rvecsR"]) == 12
+    for l, r in zip(model["imgpointsL"], model["imgpointsR"]):
+        assert np.allclose(l.reshape(-1,2) - r.reshape(-1,2), (20,0), atol=0.5)
+
+    # reuse mono calibrations
+    cal = CameraCalibration()
+    mono = (cal.calibrate(left, board), cal.calibrate(right, board))
+    r, m = sc.calibrate(None, None, board, mono=mono)
+    assert abs(r - ret) < 1e-6
+    assert np.allclose(m["T"], model["T"])
+
+def test_stereo_reproject():
+    from opencv_camera.stereo.pointcloud import Stereo2PointCloud
+    pc = Stereo2PointCloud(0.1, 500, 480, 640)
+    rng = np.random.default_rng(0)
+    disp = rng.uniform(-1, 64, (480,640)).astype(np.float32)
+    img = rng.integers(0, 255, (480,640,3), dtype=np.uint8)
+
+    pts, colors = pc.reproject(img, disp)
+    mask = disp > 0
+    ref = cv2.reprojectImageTo3D(disp, pc.Q)[mask]
+    assert np.allclose(pts, ref)
+    assert np.array_equal(colors, img[mask])
+
+    # every other pixel inside 1-5 units away, same for gray images
+    pts, colors = pc.reproject(img[...,0], disp, stride=2, min_depth=1, max_depth=5)
+    z = np.abs(pts[:,2])
+    assert z.min() >= 1 - 1e-4 and z.max() <= 5 + 1e-4
+    d = disp[::2, ::2]
+    assert len(pts) == np.count_nonzero((d >= 500*0.1/5) & (d <= 500*0.1/1))
+    assert colors.shape == pts.shape
+
+def test_stereo_matcher():
+    rng = np.random.default_rng(1)
+    left = cv2.resize(rng.integers(0, 255, (120,160), dtype=np.uint8), (640,480))
+    right = np.roll(left, -20, axis=1) # everything 20 px of disparity
+
+    for alg in ["bm", "sgbm", "sgbm3way"]:
+        for scale in [1, 2, 4]:
+            m = StereoMatcher(alg, 0, 64, block_size=7, scale=scale)
+            disp = m.compute(left, right)
+            assert disp.shape == left.shape and disp.dtype == np.float32
+            assert np.median(disp[100:380,100:540]) == 20
+
+    # bands stitch back to about the same disparity as one pass
+    ref = StereoMatcher("sgbm", 0, 64, block_size=7).compute(left, right)
+    m = StereoMatcher("sgbm", 0, 64, block_size=7, bands=3)
+    disp = m.compute(left, right)
+    m.close()
+    assert disp.shape == ref.shape
+    assert np.mean(disp != ref) < 0.001
+
+    m = StereoMatcher.fromDepth(0.1, 500, 0.5, 10)
+    assert m.min_disp == 5 and m.num_disp >= 100 - 5 and m.num_disp % 16 == 0
+
+    with pytest.raises(ValueError):
+        StereoMatcher("census")
+
+def test_ply(tmp_path):
+    from opencv_camera.save.pointcloud import PLY
+    rng = np.random.default_rng(0)
+    verts = rng.normal(size=(1000,3)).astype(np.float32)
+    colors = rng.integers(0, 255, (1000,3), dtype=np.uint8)
+    ply = PLY()
+
+    ply.write(tmp_path / "b.ply", verts, colors)
+    v, c = ply.read(tmp_path / "b.ply")
+    assert np.array_equal(v, verts) and np.array_equal(c, colors)
+
+    ply.write(tmp_path / "a.ply", verts, colors, binary=False)
+    v, c = ply.read(tmp_path / "a.ply")
+    assert np.allclose(v, verts, atol=1e-5) and np.array_equal(c, colors)
+
+    with ply.open(tmp_path / "s.ply") as w:
+        for i in range(0, 1000, 300):
+            w.append(verts[i:i+300], colors[i:i+300])
+    v, c = ply.read(tmp_path / "s.ply")
+    assert np.array_equal(v, verts) and np.array_equal(c, colors)
+
+def test_udp_transport():
+    import socket
+    from opencv_camera.udp_transport import sendFrame, FrameAssembler
+
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2**22)
+    rx.bind(("127.0.0.1", 0))
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    # much bigger than one datagram
+    data = np.random.default_rng(0).integers(0, 255, 300_000, dtype=np.uint8)
+    fa = FrameAssembler()
+    sendFrame(tx, rx.getsockname(), 7, data)
+    frame = fa.recv(rx, 1)
+    assert frame is not None and np.array_equal(frame, data)
+    assert fa.recv(rx, 0.05) is None
+    tx.close()
+    rx.close()
+
+    # sockets without sendmsg() (windows) send a copy of each chunk
+    class SendTo:
+        packets = []
+        def sendto(self, packet, address):
+            self.packets.append(packet)
+
+    cap = SendTo()
+    sendFrame(cap, None, 3, data[:5000], chunk_size=1000)
+    fa = FrameAssembler()
+    frames = [fa.add(p) for p in cap.packets]
+    assert np.array_equal(frames[-1], data[:5000])
+
+    # out of order chunks, a lost chunk drops the frame
+    class Capture:
+        packets = []
+        def sendmsg(self, bufs, anc, flags, address):
+            self.packets.append(b"".join(bytes(b) for b in bufs))
+
+    cap = Capture()
+    sendFrame(cap, None, 1, data[:5000], chunk_size=1000)
+    sendFrame(cap, None, 2, data[:3000], chunk_size=1000)
+    first, second = cap.packets[:5], cap.packets[5:]
+
+    fa = FrameAssembler()
+    for p in first[::-1][:-1]:
+        assert fa.add(p) is None
+    out = [fa.add(p) for p in second]
+    assert out[:2] == [None, None]
+    assert np.array_equal(out[2], data[:3000])
+    assert fa.dropped == 1 and fa.received == 1
+    assert fa.add(first[0]) is None # too late
+
+    # the sender restarted and counts from 0 again
+    def frame(fid, size=500):
+        cap.packets = []
+        sendFrame(cap, None, fid, data[:size], chunk_size=1000)
+        return cap.packets[0]
+
+    fa = FrameAssembler(timeout=0.05)
+    assert fa.add(frame(5)) is not None
+    assert fa.add(frame(1)) is None # could be a late chunk
+    time.sleep(0.1)
+    assert fa.add(frame(1)) is not None
+    assert fa.add(frame(2)) is not None
+
+    assert fa.add(frame(5000)) is not None
+    assert fa.add(frame(3)) is not None # far behind, no waiting
+
+    # chunks that don't fit the frame being put together are garbage
+    from opencv_camera.udp_transport import HEADER
+    cap.packets = []
+    sendFrame(cap, None, 1, data[:900], chunk_size=500)
+    first, second = cap.packets
+    fa = FrameAssembler(max_size=1000)
+    assert fa.add(first) is None
+    bad = [
+        HEADER.pack(1, 100000, 1, 2, 5000) + bytes(400), # another size
+        HEADER.pack(1, 900, 1, 3, 500) + bytes(400),     # another count
+        HEADER.pack(1, 900, 1, 2, 0) + bytes(400),       # offset isn't the index
+        HEADER.pack(1, 900, 1, 2, 450) + bytes(450),     # another chunk size
+    ]
+    for p in bad:
+        assert fa.add(p) is None
+    assert len(fa.buffers[0]) == len(fa.buffers[1]) == 1000
+    frame = fa.add(second)
+    assert frame is not None and np.array_equal(frame, data[:900])
+
+def test_udp_reply_ids():
+    import itertools
+    from opencv_camera.bin.udp_server import reply
+    from opencv_camera.udp_transport import FrameAssembler
+
+    class Grabber:
+        def wait_frame(self, count, timeout=1.0):
+            return 1, np.arange(3000, dtype=np.uint8)
+
+    class Capture:
+        packets = []
+        def sendmsg(self, bufs, anc, flags, address):
+            self.packets.append(b"".join(bytes(b) for b in bufs))
+
+    # asking twice before the camera has a new frame still gets two frames
+    cap = Capture()
+    ids = itertools.count(1)
+    fa = FrameAssembler()
+    for _ in range(2):
+        cap.packets = []
+        reply(cap, None, Grabber(), ids, 1000)
+        frames = [fa.add(p) for p in cap.packets]
+        assert frames[-1] is not None
+    assert fa.received == 2
+
+def test_udp_subscribers():
+    from opencv_camera.udp_transport import Subscribers, packControl, unpackControl
+    from opencv_camera.udp_transport import SUBSCRIBE, REQUEST
+
+    assert unpackControl(packControl(SUBSCRIBE, 10)) == (SUBSCRIBE, 10)
+    assert unpackControl(packControl(REQUEST)) == (REQUEST, 0)
+    assert unpackControl(b"") == (None, 0)
+
+    subs = Subscribers(expire=0.2)
+    subs.subscribe("fast")
+    subs.subscribe("slow", rate=4)
+    assert subs.due() == ["fast", "slow"]
+    assert subs.due() == ["fast"] # slow only gets 4 per second
+
+    time.sleep(0.3)
+    subs.subscribe("slow", rate=4) # keepalive, fast expired
+    assert subs.due() == ["slow"]
+    assert len(subs) == 1
+
+def test_mjpeg_broadcaster(tmp_path):
+    from opencv_camera.bin.mjpeg_server import JpegBroadcaster
+    fname = str(tmp_path / "frames.avi")
+    make_video(fname)
+
+    cam = ThreadedCamera(thread_hz=30)
+    cam.open(fname)
+    b = JpegBroadcaster(cam, queue_size=2)
+    fast = b.subscribe()
+    slow = b.subscribe() # never reads
+    b.start()
+
+    jpgs = []
+    for _ in range(6):
+        try:
+            jpgs.append(fast.get(timeout=1))
+        except Exception:
+            break
+    b.stop()
+    cam.close()
+
+    # encoded once per frame no matter how many clients
+    assert len(jpgs) == b.encoded > 1
+    assert slow.qsize() == 2
+    assert cv2.imdecode(np.frombuffer(jpgs[0], np.uint8), 1).shape == (48,64,3)
+
+def test_async_camera(tmp_path):
+    import asyncio
+    fname = str(tmp_path / "frames.avi")
+    make_video(fname)
+
+    async def consume(maxsize, delay):
+        cam = AsyncCamera(ThreadedCamera(thread_hz=60), maxsize=maxsize)
+        cam.open(fname)
+        seqs = []
+        try:
+            while True:
+                frame = await asyncio.wait_for(cam.next_frame(), 0.5)
+                seqs.append(frame.seq)
+                await asyncio.sleep(delay) # slow consumer
+        except asyncio.TimeoutError:
+            pass
+
+        # closing ends async for
+        await cam.aclose()
+        async for frame in cam:
+            seqs.append(-1)
+        return seqs, cam.dropped
+
+    seqs, dropped = asyncio.run(consume(16, 0))
+    assert seqs == list(range(seqs[0], 6)) and dropped == 0
+
+    seqs, dropped = asyncio.run(consume(1, 0.05))
+    assert seqs == sorted(seqs) and seqs[-1] == 5
+    assert len(seqs) + dropped == 6 - seqs[0] and dropped > 0
+
+def test_async_camera_consumers(tmp_path):
+    import asyncio
+    fname = str(tmp_path / "frames.avi")
+    make_video(fname)
+
+    async def consume(cam, seqs):
+        async for frame in cam:
+            seqs.append(frame.seq)
+
+    async def main():
+        cam = AsyncCamera(ThreadedCamera(thread_hz=60), maxsize=16)
+        a, b = [], []
+        tasks = [asyncio.create_task(consume(cam, s)) for s in [a, b]]
+        await asyncio.sleep(0) # both are waiting before the first frame
+        cam.open(fname)
+        await asyncio.sleep(0.5)
+        await cam.aclose()
+        await asyncio.wait_for(asyncio.gather(*tasks), 1)
+        return a, b
+
+    # each frame goes to one of them and neither is left hanging
+    a, b = asyncio.run(main())
+    assert sorted(a + b) == list(range(6))
+
+def test_shared_frames(tmp_path):
+    pub = FramePublisher((48,64,3), np.uint8, capacity=3)
+    sub = FrameSubscriber(pub.name)
+    assert sub.shape == (48,64,3) and sub.dtype == np.uint8
+    assert sub.latest()[2] is None
+
+    for i in range(4):
+        pub.publish(np.full((48,64,3), i, dtype=np.uint8), timestamp=float(i))
+
+    seq, ts, img = sub.latest()
+    assert (seq, ts) == (3, 3.0) and np.all(img == 3)
+    assert sub.get(0) == (None, None) # overwritten
+
+    # other shapes and types are refused, not silently converted
+    with pytest.raises(ValueError):
+        pub.publish(np.full((48,64,3), 300.7, dtype=np.float32))
+    with pytest.raises(ValueError):
+        pub.publish(np.zeros((48,64), dtype=np.uint8))
+    assert pub.head == 3
+    assert sub.valid(1) and not sub.valid(0)
+
+    # views are shared memory, a copy is not
+    _, view = sub.get(1)
+    _, cpy = sub.get(1, copy=True)
+    pub.publish(np.full((48,64,3), 9, dtype=np.uint8))
+    assert np.all(view == 9) and np.all(cpy == 1)
+    assert not sub.valid(1)
+    del view, img
+
+    # publish every camera frame
+    fname = str(tmp_path / "frames.avi")
+    make_video(fname)
+    cam = ThreadedCamera(thread_hz=None)
+    pub.attach(cam)
+    cam.open(fname)
+    seq, ts, img = sub.wait(4, timeout=2)
+    assert seq > 4 and img.shape == (48,64,3)
+    del img
+    cam.close()
+
+    sub.close()
+    pub.close()
+    pub.unlink()
+
+    with pytest.raises(ValueError):
+        FramePublisher((48,64), capacity=1)